@@ -0,0 +1,72 @@
+"""
+Compare compiling code blocks padded with newlines, as it was done
+before, with ``compile_source`` at increasing block positions.
+
+Usage::
+
+    python benchmarks/bench_compile.py [--repeat 200]
+"""
+
+import argparse
+import json
+import time
+from typing import Callable
+
+from pytest_rst import compile_source
+
+
+SOURCE = """\
+import os
+
+value = 42
+assert value == 42
+assert os.path.sep
+"""
+
+POSITIONS = (0, 1_000, 10_000, 100_000, 1_000_000)
+
+
+def padded_compile(source: str, filename: str, offset: int) -> object:
+    return compile("\n" * offset + source, filename, "exec")
+
+
+def measure(
+    function: Callable[[str, str, int], object],
+    offset: int,
+    repeat: int,
+) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(SOURCE, "doc.rst", offset)
+    return (time.perf_counter() - started) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    arguments = parser.parse_args()
+
+    print(
+        json.dumps(
+            {
+                str(offset): {
+                    "padded_seconds": measure(
+                        padded_compile,
+                        offset,
+                        arguments.repeat,
+                    ),
+                    "shifted_seconds": measure(
+                        compile_source,
+                        offset,
+                        arguments.repeat,
+                    ),
+                }
+                for offset in POSITIONS
+            },
+            indent=2,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Compare ``parse_code_blocks`` with the original implementation, which
+materialised the whole file, matched directive options with uncompiled
+patterns and counted indentation character by character.
+
+Usage::
+
+    python benchmarks/bench_parser.py [--size-mb 8] [--repeat 3]
+"""
+
+import argparse
+import json
+import logging
+import re
+import time
+import tracemalloc
+from io import StringIO
+from typing import Callable, Iterator, List, Optional, TextIO, Tuple
+
+from corpus import make_document
+from pytest_rst import CodeBlock, CodeLine, get_indent, parse_code_blocks
+
+
+CODE_BLOCK_REGEXP = re.compile(r"^\.\. code-block::(\s*(?P<syntax>\S+)\s*)?$")
+
+
+def legacy_get_indent(s: str, *, indent_char: str = " ") -> int:
+    if not s.strip():
+        return -1
+
+    if not s.startswith(indent_char):
+        return 0
+
+    result = 0
+    for c in s:
+        if c != indent_char:
+            return result
+        result += 1
+
+    return result
+
+
+def legacy_parse_code_blocks(fp: TextIO) -> Iterator[CodeBlock]:
+    fp.seek(0)
+
+    code_lines: List[CodeLine] = []
+    code_block_indent: int = -2
+    directive_line = 0
+    syntax: Optional[str] = None
+
+    content = tuple(
+        map(
+            lambda x: (legacy_get_indent(x[1]), x[0], x[1]),
+            enumerate(fp, start=0),
+        ),
+    )
+
+    index = -1
+    while index < (len(content) - 1):
+        index += 1
+        indent, lineno, line = content[index]
+
+        if indent < 0:
+            continue
+
+        if code_block_indent == -2:
+            match = CODE_BLOCK_REGEXP.match(line[indent:])
+            if match is None:
+                continue
+            groups = match.groupdict()
+            syntax = groups.get("syntax") or None
+            code_block_indent = -1
+            directive_line = lineno
+            continue
+
+        if code_block_indent == -1:
+            code_block_indent = indent
+
+        if indent >= code_block_indent:
+            code_lines.append(
+                CodeLine(lineno=lineno, line=line[code_block_indent:]),
+            )
+            continue
+
+        if syntax == "python":
+            params_parsed = False
+            params: List[Tuple[str, str]] = []
+            line_first: int = code_lines[0].lineno
+            result_lines = []
+            previous_line = 0
+
+            for lineno, line in code_lines:
+                if not line.startswith(":") and not params_parsed:
+                    params_parsed = True
+                    line_first = lineno
+
+                if not params_parsed:
+                    match = re.match(
+                        r"^:(?P<param>.*):\s*(?P<value>.*)?$",
+                        line,
+                    )
+                    if match is None:
+                        logging.warning(
+                            "Ignore bad formatted rst param %r at line %d",
+                            line,
+                            lineno,
+                        )
+                        continue
+                    groups = match.groupdict()
+                    params.append((groups["param"], groups.get("value") or ""))
+                    continue
+
+                if previous_line and lineno != (previous_line + 1):
+                    for _ in range(lineno - (previous_line + 1)):
+                        result_lines.append("")
+
+                result_lines.append(line.rstrip())
+                previous_line = lineno
+
+            yield CodeBlock(
+                syntax=syntax,
+                start_line=line_first,
+                params=tuple(params),
+                lines=tuple(result_lines),
+                directive_line=directive_line,
+            )
+            result_lines.clear()
+
+        code_lines = []
+        syntax = None
+        code_block_indent = -2
+        index -= 1
+
+
+def measure(
+    parser: Callable[[TextIO], Iterator[CodeBlock]],
+    document: str,
+    repeat: int,
+) -> dict:
+    timings = []
+    for _ in range(repeat):
+        fp = StringIO(document)
+        started = time.perf_counter()
+        for _ in parser(fp):
+            pass
+        timings.append(time.perf_counter() - started)
+
+    fp = StringIO(document)
+    tracemalloc.start()
+    for _ in parser(fp):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = document.count("\n")
+    best = min(timings)
+    return {
+        "best_seconds": best,
+        "lines_per_second": lines / best,
+        "peak_memory_bytes": peak,
+    }
+
+
+def measure_get_indent(
+    function: Callable[[str], int],
+    document: str,
+    repeat: int,
+) -> float:
+    lines = document.splitlines(keepends=True)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for line in lines:
+            function(line)
+        timings.append(time.perf_counter() - started)
+    return len(lines) / min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    document = make_document(arguments.size_mb)
+    assert list(legacy_parse_code_blocks(StringIO(document))) == list(
+        parse_code_blocks(StringIO(document)),
+    )
+
+    legacy = measure(legacy_parse_code_blocks, document, arguments.repeat)
+    current = measure(parse_code_blocks, document, arguments.repeat)
+    print(
+        json.dumps(
+            {
+                "document_bytes": len(document),
+                "document_lines": document.count("\n"),
+                "legacy": legacy,
+                "current": current,
+                "speedup": legacy["best_seconds"] / current["best_seconds"],
+                "get_indent_speedup": (
+                    measure_get_indent(get_indent, document, arguments.repeat)
+                    / measure_get_indent(
+                        legacy_get_indent,
+                        document,
+                        arguments.repeat,
+                    )
+                ),
+            },
+            indent=2,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
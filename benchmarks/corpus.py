@@ -0,0 +1,112 @@
+"""
+Synthetic RST corpora used by the benchmarks. Every generator is
+deterministic so results of different runs are comparable.
+"""
+
+from io import StringIO
+from pathlib import Path
+from typing import Dict
+
+
+SECTION = """\
+Section {index}
+==========
+
+Some text describing the example number {index}, long enough to look
+like real prose in generated API reference pages.
+
+.. code-block:: python
+    :name: test_example_{index}
+
+    import os
+
+    value = {index}
+    assert value == {index}
+    assert os.path.sep
+
+.. note::
+
+    Nested example:
+
+    .. code-block:: python
+
+        print({index})
+
+"""
+
+FIXTURE_SECTION = """\
+Example {index}
+----------
+
+.. code-block:: python
+    :name: test_fixture_{index}
+
+    # fixtures: {fixtures}
+    assert tmp_path.is_dir()
+
+"""
+
+FIXTURE_SETS = ("tmp_path", "tmp_path, capsys", "tmp_path, monkeypatch")
+
+
+def make_document(size_mb: float) -> str:
+    """One document of roughly ``size_mb`` megabytes"""
+    result = StringIO()
+    index = 0
+    while result.tell() < size_mb * 1024 * 1024:
+        result.write(SECTION.format(index=index))
+        index += 1
+    return result.getvalue()
+
+
+def make_deep_document(blocks: int, depth: int) -> str:
+    """Blocks nested into ``depth`` levels of directives"""
+    result = StringIO()
+    for index in range(blocks):
+        indent = ""
+        for level in range(depth):
+            result.write(f"{indent}.. note::\n\n")
+            indent += "    "
+            result.write(f"{indent}Level {level}\n\n")
+        result.write(
+            f"{indent}.. code-block:: python\n"
+            f"{indent}    :name: test_deep_{index}\n\n"
+            f"{indent}    value = {index}\n"
+            f"{indent}    assert value == {index}\n\n",
+        )
+        result.write("End of example.\n\n")
+    return result.getvalue()
+
+
+def make_fixture_document(blocks: int) -> str:
+    return "".join(
+        FIXTURE_SECTION.format(
+            index=index,
+            fixtures=FIXTURE_SETS[index % len(FIXTURE_SETS)],
+        )
+        for index in range(blocks)
+    )
+
+
+CORPORA = {
+    "small_files": lambda: {
+        f"page_{index}.rst": make_document(0.002) for index in range(500)
+    },
+    "huge_files": lambda: {
+        f"reference_{index}.rst": make_document(4) for index in range(3)
+    },
+    "deep_indent": lambda: {"deep.rst": make_deep_document(2000, 12)},
+    "fixture_blocks": lambda: {"fixtures.rst": make_fixture_document(500)},
+}
+
+
+def make_corpus(name: str) -> Dict[str, str]:
+    return CORPORA[name]()
+
+
+def write_corpus(name: str, directory: Path) -> Dict[str, str]:
+    files = make_corpus(name)
+    directory.mkdir(parents=True, exist_ok=True)
+    for filename, content in files.items():
+        (directory / filename).write_text(content)
+    return files
@@ -0,0 +1,245 @@
+"""
+Benchmark suite for the parser, compiler and executor hot paths.
+
+Results are printed (or written with ``--output``) as JSON with stable
+keys, ``--compare`` prints the ratio of each metric to a previous result.
+
+Usage::
+
+    python benchmarks/run.py [--output result.json] [--compare old.json]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+from corpus import CORPORA, make_corpus, write_corpus
+from pytest_rst import (
+    PLUGIN_VERSION,
+    get_indent,
+    parse_code_blocks,
+    parse_code_blocks_mapped,
+)
+
+
+# Metrics where a lower value is better, everything else is a throughput
+LOWER_IS_BETTER = ("seconds", "per_block", "per_item", "bytes")
+
+INDENT_LINES = (
+    "plain text line\n",
+    "    indented code line\n",
+    "            deeply indented code line\n",
+    "\n",
+    "        \n",
+    "\ttab indented line\n",
+)
+
+
+def best_of(repeat: int, function: Callable[[], Any]) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_parse(corpus: str, repeat: int) -> Dict[str, float]:
+    files = make_corpus(corpus)
+    lines = sum(content.count("\n") for content in files.values())
+
+    def parse() -> None:
+        for content in files.values():
+            for _ in parse_code_blocks(StringIO(content)):
+                pass
+
+    seconds = best_of(repeat, parse)
+    return {"seconds": seconds, "lines_per_second": lines / seconds}
+
+
+def bench_parse_mapped(corpus: str, repeat: int) -> Dict[str, float]:
+    files = {
+        name: content.encode() for name, content in make_corpus(corpus).items()
+    }
+    lines = sum(content.count(b"\n") for content in files.values())
+
+    def parse() -> None:
+        for content in files.values():
+            for _ in parse_code_blocks_mapped(content):
+                pass
+
+    seconds = best_of(repeat, parse)
+    return {"seconds": seconds, "lines_per_second": lines / seconds}
+
+
+def bench_memory(corpus: str) -> Dict[str, float]:
+    files = make_corpus(corpus)
+
+    tracemalloc.start()
+    blocks = [
+        block
+        for content in files.values()
+        for block in parse_code_blocks(StringIO(content))
+    ]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "retained_bytes": float(retained),
+        "retained_bytes_per_block": retained / len(blocks),
+    }
+
+
+def bench_get_indent(repeat: int) -> Dict[str, float]:
+    lines = INDENT_LINES * 100_000
+
+    def run() -> None:
+        for line in lines:
+            get_indent(line)
+
+    seconds = best_of(repeat, run)
+    return {"seconds": seconds, "calls_per_second": len(lines) / seconds}
+
+
+def run_pytest(directory: Path, *args: str) -> float:
+    started = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        code = pytest.main(
+            ["-q", "--rootdir", str(directory), *args],
+        )
+    if code not in (pytest.ExitCode.OK, pytest.ExitCode.NO_TESTS_COLLECTED):
+        raise RuntimeError(f"pytest failed with {code!r} for {directory}")
+    return time.perf_counter() - started
+
+
+def count_blocks(files: Dict[str, str]) -> int:
+    return sum(content.count(":name: test_") for content in files.values())
+
+
+def bench_collect(corpus: str, repeat: int) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        files = write_corpus(corpus, directory)
+        blocks = count_blocks(files)
+
+        cold = best_of(
+            repeat,
+            lambda: run_pytest(
+                directory,
+                "--collect-only",
+                "-p",
+                "no:cacheprovider",
+                str(directory),
+            ),
+        )
+        run_pytest(directory, "--collect-only", str(directory))
+        warm = best_of(
+            repeat,
+            lambda: run_pytest(directory, "--collect-only", str(directory)),
+        )
+    return {
+        "cold_seconds": cold,
+        "cold_seconds_per_block": cold / blocks,
+        "warm_seconds": warm,
+        "warm_seconds_per_block": warm / blocks,
+    }
+
+
+def bench_execute(corpus: str, repeat: int) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        files = write_corpus(corpus, directory)
+        items = count_blocks(files)
+
+        run_pytest(directory, "--collect-only", str(directory))
+        collect = best_of(
+            repeat,
+            lambda: run_pytest(directory, "--collect-only", str(directory)),
+        )
+        total = best_of(repeat, lambda: run_pytest(directory, str(directory)))
+    return {
+        "seconds": total,
+        "seconds_per_item": max(total - collect, 0.0) / items,
+    }
+
+
+def run_suite(repeat: int, corpora: List[str]) -> Dict[str, Any]:
+    return {
+        "plugin_version": PLUGIN_VERSION,
+        "python": sys.version.split()[0],
+        "get_indent": bench_get_indent(repeat),
+        "parse": {name: bench_parse(name, repeat) for name in corpora},
+        "parse_mapped": {
+            name: bench_parse_mapped(name, repeat) for name in corpora
+        },
+        "memory": {name: bench_memory(name) for name in corpora},
+        "collect": {
+            name: bench_collect(name, repeat)
+            for name in corpora
+            if name != "huge_files"
+        },
+        "execute": {
+            name: bench_execute(name, repeat)
+            for name in ("small_files", "fixture_blocks")
+            if name in corpora
+        },
+    }
+
+
+def flatten(result: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, float):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    current, previous = flatten(result), flatten(baseline)
+    for key in sorted(current.keys() & previous.keys()):
+        if not previous[key]:
+            continue
+        ratio = current[key] / previous[key]
+        if key.endswith(LOWER_IS_BETTER):
+            speedup = 1 / ratio if ratio else float("inf")
+        else:
+            speedup = ratio
+        print(f"{key:60} {speedup:6.2f}x", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=sorted(CORPORA),
+        help="Run only the given corpora, may be repeated",
+    )
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path)
+    arguments = parser.parse_args()
+
+    result = run_suite(arguments.repeat, arguments.corpus or sorted(CORPORA))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if arguments.output:
+        arguments.output.write_text(text)
+    else:
+        print(text)
+
+    if arguments.compare:
+        compare(result, json.loads(arguments.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
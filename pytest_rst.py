@@ -1,52 +1,247 @@
+import ast
+import builtins
+import dis
+import hashlib
+import inspect
+import importlib
+import json
 import logging
+import marshal
+import mmap
+import os
+import queue
 import re
+import sys
 import textwrap
-from io import StringIO
+import time
+import traceback
+from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
+import tracemalloc
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from contextvars import ContextVar
+from fnmatch import fnmatch
+from functools import lru_cache, partial
+from importlib.metadata import PackageNotFoundError, version
+from importlib.util import MAGIC_NUMBER
+from io import BytesIO, StringIO, TextIOWrapper
 from pathlib import Path
-from types import CodeType, FunctionType
+from types import CodeType, FunctionType, TracebackType
 from typing import (
     Any,
+    Awaitable,
+    Callable,
+    ClassVar,
+    ContextManager,
+    Dict,
+    Generator,
     Iterable,
     Iterator,
     List,
     NamedTuple,
+    NoReturn,
     Optional,
+    Sequence,
+    Set,
+    TYPE_CHECKING,
     TextIO,
     Tuple,
+    Type,
+    TypeVar,
+    Union,
 )
 
 import pytest
 
 
-class CodeBlock(NamedTuple):
+# Imported lazily, they take more time to import than the plugin itself
+if TYPE_CHECKING:
+    import asyncio
+    import cProfile
+    import doctest
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from multiprocessing.connection import Connection
+    from multiprocessing.context import ForkServerContext, SpawnContext
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore[assignment]
+
+
+log = logging.getLogger(__name__)
+T = TypeVar("T")
+
+try:
+    PLUGIN_VERSION = version("pytest-rst")
+except PackageNotFoundError:  # pragma: no cover
+    PLUGIN_VERSION = "unknown"
+
+
+class CodeBlock:
+    """
+    Code block of an RST document. Lines are kept joined in ``source``
+    and split on first access, large documentation trees hold tens of
+    thousands of blocks for the whole session.
+
+    ``start_line`` is the 0-based line of the first code line and
+    ``directive_line`` the one of the ``.. code-block::`` directive, or
+    of the first line of a plain ``>>>`` paragraph.
+
+    Blocks can still be used as the ``(start_line, params, syntax, lines)``
+    named tuple they used to be.
+    """
+
+    __slots__ = (
+        "start_line",
+        "params",
+        "syntax",
+        "source",
+        "line_count",
+        "directive_line",
+        "_lines",
+    )
+
+    _fields: ClassVar[Tuple[str, ...]] = (
+        "start_line",
+        "params",
+        "syntax",
+        "lines",
+    )
+
     start_line: int
     params: Tuple[Tuple[str, str], ...]
     syntax: Optional[str]
-    lines: Tuple[str, ...]
+    source: str
+    line_count: int
+    directive_line: int
+    _lines: Optional[Tuple[str, ...]]
+
+    def __init__(
+        self,
+        start_line: int,
+        params: Iterable[Tuple[str, str]],
+        syntax: Optional[str],
+        lines: Sequence[str],
+        directive_line: Optional[int] = None,
+    ):
+        self.start_line = start_line
+        self.directive_line = (
+            start_line if directive_line is None else directive_line
+        )
+        self.params = tuple((sys.intern(name), value) for name, value in params)
+        self.syntax = sys.intern(syntax) if syntax else None
+        self.source = "\n".join(lines)
+        self.line_count = len(lines)
+        self._lines = None
+
+    @classmethod
+    def from_source(
+        cls,
+        start_line: int,
+        params: Iterable[Tuple[str, str]],
+        syntax: Optional[str],
+        source: str,
+        line_count: int,
+        directive_line: Optional[int] = None,
+    ) -> "CodeBlock":
+        block = cls(start_line, params, syntax, (), directive_line)
+        block.source = source
+        block.line_count = line_count
+        return block
+
+    def _split_lines(self) -> List[str]:
+        """Split the source without keeping the lines, for a single pass"""
+        if not self.line_count:
+            return []
+        return self.source.split("\n")
+
+    @property
+    def lines(self) -> Tuple[str, ...]:
+        if self._lines is None:
+            self._lines = tuple(self._split_lines())
+        return self._lines
 
     @property
     def end_line(self) -> int:
-        return self.start_line + len(self.lines) + 1
+        return self.start_line + self.line_count + 1
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter((self.start_line, self.params, self.syntax, self.lines))
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __getitem__(self, index: Any) -> Any:
+        return tuple(self)[index]
+
+    def _asdict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+    def _replace(self, **changes: Any) -> "CodeBlock":
+        values = self._asdict()
+        values["directive_line"] = self.directive_line
+        unexpected = changes.keys() - values.keys()
+        if unexpected:
+            raise ValueError(
+                f"Got unexpected field names: {sorted(unexpected)!r}",
+            )
+        values.update(changes)
+        return CodeBlock(**values)
 
+    def _key(self) -> Tuple:
+        # Like end_line, directive_line is derived position information
+        # and is left out, blocks built from the named tuple fields
+        # compare equal to parsed ones
+        return (
+            self.start_line,
+            self.params,
+            self.syntax,
+            self.source,
+            self.line_count,
+        )
 
+    def _tuple(self) -> Tuple:
+        """The named tuple value, without keeping the split lines"""
+        lines = self._lines
+        if lines is None:
+            lines = tuple(self._split_lines())
+        return (self.start_line, self.params, self.syntax, lines)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, tuple):
+            return self._tuple() == other
+        if not isinstance(other, CodeBlock):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        # Equal blocks and tuples hash alike
+        return hash(self._tuple())
+
+    def __repr__(self) -> str:
+        return (
+            f"CodeBlock(start_line={self.start_line!r}, "
+            f"params={self.params!r}, syntax={self.syntax!r}, "
+            f"lines={self.lines!r}, "
+            f"directive_line={self.directive_line!r})"
+        )
+
+
+CODE_BLOCK_DIRECTIVE = ".. code-block::"
+DOCTEST_PROMPT = ">>>"
+# Pygments names of interactive session blocks, plain ``>>>`` blocks
+# are yielded with the first one
+DOCTEST_SYNTAXES = ("pycon", "python-console")
 CODE_BLOCK_REGEXP = re.compile(r"^\.\. code-block::(\s*(?P<syntax>\S+)\s*)?$")
+PARAM_REGEXP = re.compile(r"^:(?P<param>.*):\s*(?P<value>.*)?$")
 COMMENT_FIXTURES_REGEXP = re.compile(r"^#\s*fixtures:\s*(.+)$")
 
 
 def get_indent(s: str, *, indent_char: str = " ") -> int:
-    if not s.strip():
+    stripped = s.lstrip(indent_char)
+    if not stripped or stripped.isspace():
         return -1
-
-    if not s.startswith(indent_char):
-        return 0
-
-    result = 0
-    for c in s:
-        if c != indent_char:
-            return result
-        result += 1
-
-    return result
+    return len(s) - len(stripped)
 
 
 class CodeLine(NamedTuple):
@@ -54,214 +249,3240 @@ class CodeLine(NamedTuple):
     line: str
 
 
-def parse_code_blocks(fp: TextIO) -> Iterator[CodeBlock]:
+def _build_code_block(
+    syntax: Optional[str],
+    code_lines: List[Tuple[int, str]],
+    directive_line: int,
+) -> CodeBlock:
+    params_parsed = False
+    params: List[Tuple[str, str]] = []
+    line_first: int = code_lines[0][0]
+    result_lines = []
+    previous_line = 0
+
+    for lineno, line in code_lines:
+        if not line.startswith(":") and not params_parsed:
+            params_parsed = True
+            line_first = lineno
+
+        if not params_parsed:
+            match = PARAM_REGEXP.match(line)
+            if match is None:
+                logging.warning(
+                    "Ignore bad formatted rst param %r at line %d",
+                    line,
+                    lineno,
+                )
+                continue
+            groups = match.groupdict()
+            params.append((groups["param"], groups.get("value") or ""))
+            continue
+
+        if previous_line and lineno != (previous_line + 1):
+            result_lines.extend([""] * (lineno - (previous_line + 1)))
+
+        result_lines.append(line.rstrip())
+        previous_line = lineno
+
+    return CodeBlock(
+        syntax=syntax,
+        start_line=line_first,
+        params=tuple(params),
+        lines=tuple(result_lines),
+        directive_line=directive_line,
+    )
+
+
+def parse_code_blocks(
+    fp: TextIO,
+    interactive: bool = False,
+) -> Iterator[CodeBlock]:
+    """
+    Yield python code blocks from an RST document.
+
+    The file is consumed line by line, only the lines of the code block
+    being parsed are kept in memory. A block is finished by the first
+    non-blank line indented less than its body, blocks still open at the
+    end of the file are not yielded.
+
+    With ``interactive`` session blocks are yielded as well,
+    including plain ``>>>`` paragraphs, which end at a blank line.
+    """
     fp.seek(0)
 
-    code_lines: List[CodeLine] = []
+    # Plain tuples, building a CodeLine per line is noticeably slower
+    code_lines: List[Tuple[int, str]] = []
     code_block_indent: int = -2
+    directive_line = 0
     syntax: Optional[str] = None
+    syntaxes: Tuple[str, ...] = ("python",)
+    starts: Union[str, Tuple[str, ...]] = CODE_BLOCK_DIRECTIVE
+    if interactive:
+        syntaxes += DOCTEST_SYNTAXES
+        starts = (CODE_BLOCK_DIRECTIVE, DOCTEST_PROMPT)
+    # The block is a plain ``>>>`` paragraph
+    paragraph = False
 
-    content = tuple(
-        map(
-            lambda x: (get_indent(x[1]), x[0], x[1]),
-            enumerate(fp, start=0),
-        ),
-    )
+    for lineno, line in enumerate(fp):
+        stripped = line.lstrip(" ")
 
-    index = -1
-    while index < (len(content) - 1):
-        index += 1
-        indent, lineno, line = content[index]
+        if code_block_indent != -2:
+            # Same as get_indent(), inlined since it runs for every line
+            if not stripped or stripped.isspace():
+                if paragraph:
+                    yield _build_code_block(
+                        syntax,
+                        code_lines,
+                        directive_line,
+                    )
+                    code_lines = []
+                    syntax = None
+                    code_block_indent = -2
+                    paragraph = False
+                continue
+            indent = len(line) - len(stripped)
 
-        if indent < 0:
-            continue
+            if code_block_indent == -1:
+                code_block_indent = indent
 
-        if code_block_indent == -2:
-            match = CODE_BLOCK_REGEXP.match(line[indent:])
-            if match is None:
+            if indent >= code_block_indent:
+                code_lines.append((lineno, line[code_block_indent:]))
                 continue
-            groups = match.groupdict()
-            syntax = groups.get("syntax") or None
-            code_block_indent = -1
+
+            if syntax in syntaxes:
+                yield _build_code_block(syntax, code_lines, directive_line)
+
+            # The line closing the block may open the next one
+            code_lines = []
+            syntax = None
+            code_block_indent = -2
+            paragraph = False
+
+        # Most lines are prose, reject them before matching the directive
+        if not stripped.startswith(starts):
+            continue
+        if stripped.startswith(DOCTEST_PROMPT):
+            syntax = DOCTEST_SYNTAXES[0]
+            code_block_indent = len(line) - len(stripped)
+            code_lines.append((lineno, stripped))
+            directive_line = lineno
+            paragraph = True
             continue
+        match = CODE_BLOCK_REGEXP.match(stripped)
+        if match is None:
+            continue
+        syntax = match.group("syntax") or None
+        code_block_indent = -1
+        directive_line = lineno
 
-        if code_block_indent == -1:
-            code_block_indent = indent
+    # Unlike directives, a paragraph is finished by the end of the file
+    if paragraph:
+        yield _build_code_block(syntax, code_lines, directive_line)
 
-        if indent >= code_block_indent:
-            code_lines.append(
-                CodeLine(
-                    lineno=lineno,
-                    line=line[code_block_indent:],
-                ),
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def _count_lines(data: Buffer, start: int, end: int) -> int:
+    if isinstance(data, bytes):
+        return data.count(b"\n", start, end)
+    # mmap has no count(), copy bounded chunks instead of the whole range
+    chunk = 1 << 20
+    return sum(
+        data[offset:min(offset + chunk, end)].count(b"\n")
+        for offset in range(start, end, chunk)
+    )
+
+
+@lru_cache(maxsize=32)
+def _dedent_regexp(indent: int) -> "re.Pattern[bytes]":
+    """Start of a line indented less than ``indent`` and not blank"""
+    return re.compile(
+        rb"^(?!" + b" " * indent + rb")(?![ \t\r\f\v]*$)",
+        re.MULTILINE,
+    )
+
+
+def parse_code_blocks_mapped(
+    data: Buffer,
+    interactive: bool = False,
+) -> Iterator[CodeBlock]:
+    """
+    Yield python code blocks from an RST document held in a buffer,
+    usually a memory mapped file. Produces the same blocks as
+    ``parse_code_blocks``.
+
+    Directives and the ends of code blocks are located with byte
+    searches and line numbers are counted between them, only the
+    code blocks are decoded.
+    """
+    directive = CODE_BLOCK_DIRECTIVE.encode()
+    prompt = DOCTEST_PROMPT.encode()
+    find = data.find
+    size = len(data)
+    # Text mode turns "\r\n" into "\n", strip "\r" only when present
+    crlf = find(b"\r\n") >= 0
+    # Offset of the line start which number is known
+    line_start, lineno = 0, 0
+    position = 0
+    syntaxes: Tuple[str, ...] = ("python",)
+    if interactive:
+        syntaxes += DOCTEST_SYNTAXES
+    # Offset of the next ``>>>``, searched again only once passed
+    found_prompt = find(prompt) if interactive else -1
+
+    while True:
+        found = find(directive, position)
+        if 0 <= found_prompt < position:
+            found_prompt = find(prompt, position)
+
+        if found_prompt >= 0 and (found < 0 or found_prompt < found):
+            start = data.rfind(b"\n", 0, found_prompt) + 1
+            if data[start:found_prompt].strip(b" "):
+                position = found_prompt + 1
+                continue
+
+            lineno += _count_lines(data, line_start, start)
+            directive_line = lineno
+            # A paragraph ends at a blank or a less indented line
+            indent = found_prompt - start
+            code_lines = []
+            close = start
+            while close < size:
+                end = find(b"\n", close) + 1 or size
+                line = data[close:end].decode()
+                if not line.strip():
+                    close = end
+                    lineno += 1
+                    break
+                if len(line) - len(line.lstrip(" ")) < indent:
+                    break
+                code_lines.append((lineno, line[indent:]))
+                close = end
+                lineno += 1
+
+            yield _build_code_block(
+                DOCTEST_SYNTAXES[0],
+                code_lines,
+                directive_line,
             )
+            line_start = position = close
             continue
 
-        if syntax == "python":
-            # parse params
-            params_parsed = False
-            params: List[Tuple[str, str]] = []
-            line_first: int = code_lines[0].lineno
-            result_lines = []
-            previous_line = 0
-
-            for lineno, line in code_lines:
-                if not line.startswith(":") and not params_parsed:
-                    params_parsed = True
-                    line_first = lineno
-
-                if not params_parsed:
-                    match = re.match(
-                        r"^:(?P<param>.*):\s*(?P<value>.*)?$",
-                        line,
-                    )
-                    if match is None:
-                        logging.warning(
-                            "Ignore bad formatted rst param %r at line %d",
-                            line,
-                            lineno,
-                        )
-                        continue
-                    groups = match.groupdict()
-                    params.append((groups["param"], groups.get("value") or ""))
-                    continue
-
-                if previous_line and lineno != (previous_line + 1):
-                    for _ in range(lineno - (previous_line + 1)):
-                        result_lines.append("")
-
-                result_lines.append(line.rstrip())
-                previous_line = lineno
-
-            yield CodeBlock(
-                syntax=syntax,
-                start_line=line_first,
-                params=tuple(params),
-                lines=tuple(result_lines),
-            )
-            result_lines.clear()
+        if found < 0:
+            return
 
-        code_lines = []
-        syntax = None
-        code_block_indent = -2
-        index -= 1
+        start = data.rfind(b"\n", 0, found) + 1
+        end = find(b"\n", found) + 1 or size
+        position = end
+        # The directive must be preceded only by the indentation
+        if data[start:found].strip(b" "):
+            continue
+
+        lineno += _count_lines(data, line_start, start)
+        line_start = start
+        match = CODE_BLOCK_REGEXP.match(data[found:end].decode().rstrip())
+        if match is None:
+            continue
+        syntax = match.group("syntax") or None
+
+        # The first non-blank line sets the indentation of the block
+        body_start = close = end
+        indent = -1
+        while close < size:
+            end = find(b"\n", close) + 1 or size
+            line = data[close:end].decode()
+            if line.strip():
+                indent = len(line) - len(line.lstrip(" "))
+                break
+            close = end
+
+        # Candidates are checked again on decoded text, since unicode
+        # whitespace only lines are blank as well
+        regexp = _dedent_regexp(indent)
+        while indent >= 0:
+            candidate = regexp.search(data, end)
+            if candidate is None:
+                close = size
+                break
+            close = candidate.start()
+            end = find(b"\n", close) + 1 or size
+            if data[close:end].decode().strip():
+                break
+
+        # Blocks still open at the end of the file are not yielded
+        if close >= size:
+            return
+
+        text = data[body_start:close].decode()
+        if crlf:
+            text = text.replace("\r\n", "\n")
+        lines = text.split("\n")
+        # Text up to the closing line always ends with a newline
+        lines.pop()
+
+        if syntax in syntaxes:
+            code_lines = [
+                (number, line[indent:])
+                for number, line in enumerate(lines, start=lineno + 1)
+                if line.strip()
+            ]
+            yield _build_code_block(syntax, code_lines, lineno)
+
+        # The line closing the block may open the next one
+        lineno += 1 + len(lines)
+        line_start = position = close
 
 
 def _parse_fixtures(value: str) -> Tuple[str, ...]:
     return tuple(name for name in (s.strip() for s in value.split(",")) if name)
 
 
-def _make_rst_test_func(
-    code: CodeType,
-    fixture_names: Tuple[str, ...],
-) -> FunctionType:
+@lru_cache(maxsize=128)
+def _make_rst_wrapper_code(fixture_names: Tuple[str, ...]) -> CodeType:
     params = ", ".join(fixture_names)
+    values = ", ".join(f"{n!r}: {n}" for n in fixture_names)
+    # Helpers use reserved names, fixtures may be named anything else
     wrapper_src = textwrap.dedent(f"""\
         def rst_test_func({params}):
-            ns = {{"__name__": "__main__"}}
-            ns.update({{ {", ".join(f"{n!r}: {n}" for n in fixture_names)} }})
-            exec(code, ns)
+            __rst_ns__ = __rst_namespace__()
+            __rst_ns__.update({{ {values} }})
+            __rst_run__(__rst_code__, __rst_ns__)
     """)
-    local_ns: dict[str, Any] = {}
-    exec(
-        compile(wrapper_src, "<rst-fixture-wrapper>", "exec"),
-        {"code": code},
-        local_ns,
+    module = compile(wrapper_src, "<rst-fixture-wrapper>", "exec")
+    return next(c for c in module.co_consts if isinstance(c, CodeType))
+
+
+def new_namespace() -> Dict[str, Any]:
+    return {"__name__": "__main__"}
+
+
+def is_async_code(code: CodeType) -> bool:
+    """Code block uses top-level ``await`` and evaluates to a coroutine"""
+    return bool(code.co_flags & inspect.CO_COROUTINE)
+
+
+class BlockEventLoop:
+    """
+    Event loop shared by asynchronous code blocks. The loop is created
+    on the first use and can be closed and recreated any time.
+    """
+
+    def __init__(self) -> None:
+        self.loop: Optional["asyncio.AbstractEventLoop"] = None
+
+    def get(self) -> "asyncio.AbstractEventLoop":
+        if self.loop is None or self.loop.is_closed():
+            import asyncio
+
+            self.loop = asyncio.new_event_loop()
+        return self.loop
+
+    def run(self, code: CodeType, namespace: Dict[str, Any]) -> None:
+        if not is_async_code(code):
+            exec(code, namespace)
+            return
+        self.get().run_until_complete(eval(code, namespace))
+
+    def close(self) -> None:
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        finally:
+            self.loop.close()
+            self.loop = None
+
+
+def _make_rst_test_func(
+    code: Optional[CodeType],
+    fixture_names: Tuple[str, ...],
+    namespace: Callable[[], Dict[str, Any]] = new_namespace,
+    run: Callable[[CodeType, Dict[str, Any]], None] = exec,
+) -> FunctionType:
+    # Wrapper code depends only on the fixture names, so it is compiled
+    # once per signature and bound to the block code through globals.
+    return FunctionType(
+        _make_rst_wrapper_code(fixture_names),
+        {
+            "__builtins__": builtins,
+            "__rst_code__": code,
+            "__rst_namespace__": namespace,
+            "__rst_run__": run,
+        },
+        "rst_test_func",
     )
-    fn: FunctionType = local_ns["rst_test_func"]
-    return fn
 
 
-class RSTTestItem(pytest.Item):
-    def __init__(self, name: str, parent: "RSTModule", code: CodeType):
-        super().__init__(name=name, parent=parent)
-        self.module = code
+class CompiledBlock(NamedTuple):
+    name: str
+    block: CodeBlock
+    fixture_names: Tuple[str, ...]
+    code: CodeType
 
-    def runtest(self) -> None:
-        exec(self.module, {"__name__": "__main__"})
+
+def shift_code_lines(code: CodeType, offset: int) -> CodeType:
+    """
+    Move code object and all nested ones ``offset`` lines down. Line tables
+    are relative to ``co_firstlineno`` so nothing else has to be changed.
+    """
+    return code.replace(
+        co_firstlineno=code.co_firstlineno + offset,
+        co_consts=tuple(
+            shift_code_lines(const, offset)
+            if isinstance(const, CodeType)
+            else const
+            for const in code.co_consts
+        ),
+    )
 
 
-class RSTModule(pytest.Module):
-    def collect(self) -> Iterable[pytest.Item]:
-        with open(self.fspath, "r") as fp:
-            for code_block in parse_code_blocks(fp):
-                params = dict(code_block.params)
-                test_name = params.get("name")
-
-                if not test_name:
-                    continue
-
-                if not test_name.startswith(
-                    self.config.getoption("--rst-prefix"),
-                ):
-                    continue
-
-                fixtures_value = params.get("fixtures", "")
-                fixtures_found: set[str] = set(
-                    _parse_fixtures(fixtures_value),
-                )
+def _shift_syntax_error(error: SyntaxError, source: str, offset: int) -> None:
+    """Move ``error`` raised by compiling ``source`` ``offset`` lines down"""
+    if error.lineno is not None:
+        # Python reads the text from the file, at the line before shifting
+        lines = source.splitlines()
+        if 0 < error.lineno <= len(lines):
+            error.text = lines[error.lineno - 1] + "\n"
+        error.lineno += offset
+    if error.end_lineno is not None:
+        error.end_lineno += offset
 
-                # Scan for "# fixtures:" comments and strip them
-                filtered_lines = []
-                for line in code_block.lines:
-                    match = COMMENT_FIXTURES_REGEXP.match(line.strip())
-                    if match:
-                        fixtures_found.update(
-                            _parse_fixtures(match.group(1)),
-                        )
-                    else:
-                        filtered_lines.append(line)
-
-                fixture_names = tuple(sorted(fixtures_found))
-
-                with StringIO() as code_fp:
-                    code_fp.write("\n" * code_block.start_line)
-                    for line in filtered_lines:
-                        code_fp.write(line)
-                        code_fp.write("\n")
-
-                    code = compile(
-                        source=code_fp.getvalue(),
-                        mode="exec",
-                        filename=self.fspath,
-                    )
 
-                item_name = (
-                    f"{test_name}"
-                    f"[{code_block.start_line}:{code_block.end_line}]"
-                )
+def compile_source(source: str, filename: str, offset: int) -> CodeType:
+    """
+    Compile ``source`` as if it was placed ``offset`` lines below
+    the beginning of ``filename``. Top-level ``await`` is allowed.
+    """
+    try:
+        code = compile(
+            source=source,
+            filename=filename,
+            mode="exec",
+            flags=PyCF_ALLOW_TOP_LEVEL_AWAIT,
+        )
+    except SyntaxError as e:
+        _shift_syntax_error(e, source, offset)
+        raise
+    return shift_code_lines(code, offset)
 
-                if fixture_names:
-                    wrapper = _make_rst_test_func(
-                        code,
-                        fixture_names,
-                    )
-                    yield pytest.Function.from_parent(
-                        name=item_name,
-                        parent=self,
-                        callobj=wrapper,
-                    )
+
+class DocTestMismatch(AssertionError):
+    def __init__(self, lineno: int, message: str):
+        super().__init__(message)
+        self.lineno = lineno
+        self.message = message
+
+
+class DocTestExample:
+    """
+    Runs a single interactive example compiled by ``compile_doctest``,
+    captures its output and compares it with the expected one on exit.
+    An expected exception is compared with the exception raised.
+    """
+
+    __slots__ = (
+        "want",
+        "exc_msg",
+        "lineno",
+        "optionflags",
+        "output",
+        "redirect",
+    )
+
+    def __init__(
+        self,
+        want: str,
+        exc_msg: Optional[str],
+        lineno: int,
+        optionflags: int,
+    ):
+        self.want = want
+        self.exc_msg = exc_msg
+        self.lineno = lineno
+        self.optionflags = optionflags
+        self.output = StringIO()
+        self.redirect = redirect_stdout(self.output)
+
+    def __enter__(self) -> None:
+        self.redirect.__enter__()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> bool:
+        self.redirect.__exit__(None, None, None)
+        got = self.output.getvalue()
+
+        if exc is None:
+            self.check(self.want, got)
+            return False
+
+        # Unexpected exceptions and pytest outcomes are propagated
+        if self.exc_msg is None or not isinstance(exc, Exception):
+            return False
+
+        import doctest
+
+        got = traceback.format_exception_only(type(exc), exc)[-1]
+        if self.optionflags & doctest.IGNORE_EXCEPTION_DETAIL:
+            self.check(
+                self.exc_msg.split(":", 1)[0].rsplit(".", 1)[-1] + "\n",
+                got.split(":", 1)[0].rsplit(".", 1)[-1] + "\n",
+            )
+        else:
+            self.check(self.exc_msg, got)
+        return True
+
+    def check(self, want: str, got: str) -> None:
+        # Most examples match exactly, skip the checker for them
+        if want == got:
+            return
+        checker = output_checker()
+        if checker.check_output(want, got, self.optionflags):
+            return
+        import doctest
+
+        raise DocTestMismatch(
+            self.lineno,
+            checker.output_difference(
+                doctest.Example("", want),
+                got,
+                self.optionflags,
+            ),
+        )
+
+
+@lru_cache(maxsize=1)
+def output_checker() -> "doctest.OutputChecker":
+    """pytest's checker, which knows flags like NUMBER, when available"""
+    try:
+        from _pytest.doctest import _get_checker
+    except ImportError:
+        import doctest
+
+        return doctest.OutputChecker()
+    return _get_checker()
+
+
+@lru_cache(maxsize=1)
+def doctest_parser() -> "doctest.DocTestParser":
+    try:
+        from _pytest.doctest import _get_flag_lookup
+    except ImportError:
+        pass
+    else:
+        # Makes pytest specific flags like NUMBER known to the parser
+        _get_flag_lookup()
+    import doctest
+
+    return doctest.DocTestParser()
+
+
+def _call(module: str, attribute: str, *args: ast.expr) -> ast.Call:
+    """Call ``module.attribute(*args)`` importing the module in place"""
+    func = ast.Attribute(
+        value=ast.Call(
+            func=ast.Name(id="__import__", ctx=ast.Load()),
+            args=[ast.Constant(module)],
+            keywords=[],
+        ),
+        attr=attribute,
+        ctx=ast.Load(),
+    )
+    return ast.Call(func=func, args=list(args), keywords=[])
+
+
+class DisplayExpressions(ast.NodeTransformer):
+    """
+    Pass values of expression statements to ``sys.displayhook``, as the
+    interactive interpreter does outside function and class bodies.
+    """
+
+    def visit_Expr(self, node: ast.Expr) -> ast.Expr:
+        call = _call("sys", "displayhook", node.value)
+        for child in ast.walk(call):
+            if child is not node.value and "lineno" in child._attributes:
+                ast.copy_location(child, node.value)
+        node.value = call
+        return node
+
+    def skip(self, node: ast.AST) -> ast.AST:
+        return node
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = skip
+
+
+def compile_doctest(
+    source: str,
+    filename: str,
+    offset: int,
+    optionflags: int,
+) -> CodeType:
+    """
+    Compile interactive examples of ``source`` placed ``offset`` lines
+    below the beginning of ``filename`` into a single code object. Every
+    example runs in a ``DocTestExample`` context, so the expected output
+    is checked without compiling anything at run time.
+    """
+    body: List[ast.stmt] = []
+    for example in doctest_parser().get_examples(source, filename):
+        lineno = offset + example.lineno
+        flags = optionflags
+        for flag, enabled in example.options.items():
+            flags = flags | flag if enabled else flags & ~flag
+
+        try:
+            tree = ast.parse(example.source, filename, mode="single")
+        except SyntaxError as e:
+            _shift_syntax_error(e, example.source, lineno)
+            raise
+
+        statements: List[ast.stmt] = []
+        for statement in tree.body:
+            ast.increment_lineno(statement, lineno)
+            statements.append(DisplayExpressions().visit(statement))
+
+        # Examples consisting of comments only check the output as well
+        context = ast.With(
+            items=[
+                ast.withitem(
+                    context_expr=_call(
+                        "pytest_rst",
+                        "DocTestExample",
+                        ast.Constant(example.want),
+                        ast.Constant(example.exc_msg),
+                        ast.Constant(lineno + 1),
+                        ast.Constant(flags),
+                    ),
+                ),
+            ],
+            body=statements or [ast.Pass()],
+            lineno=lineno + 1,
+            col_offset=0,
+            end_lineno=statements[-1].end_lineno if statements else lineno + 1,
+            end_col_offset=0,
+        )
+        body.append(ast.fix_missing_locations(context))
+
+    return compile(
+        ast.Module(body=body, type_ignores=[]),
+        filename,
+        "exec",
+        flags=PyCF_ALLOW_TOP_LEVEL_AWAIT,
+    )
+
+
+class LazyBlock(NamedTuple):
+    """Named code block which is compiled only when it is going to run"""
+
+    name: str
+    block: CodeBlock
+    fixture_names: Tuple[str, ...]
+    filename: str
+    source: str
+    # Option flags of interactive examples, None for python code
+    doctest_flags: Optional[int] = None
+
+    def compile_code(self) -> CodeType:
+        if self.doctest_flags is not None:
+            return compile_doctest(
+                self.source,
+                self.filename,
+                self.block.start_line,
+                self.doctest_flags,
+            )
+        return compile_source(self.source, self.filename, self.block.start_line)
+
+    def compile(self) -> CompiledBlock:
+        return CompiledBlock(
+            name=self.name,
+            block=self.block,
+            fixture_names=self.fixture_names,
+            code=self.compile_code(),
+        )
+
+
+class PhaseTimer:
+    """Accumulates time spent in named phases of the collection"""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+
+    def phase(self, name: str) -> ContextManager[None]:
+        return self._measure(name)
+
+    @contextmanager
+    def _measure(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Iterate ``iterable`` counting time spent producing items"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+            yield value
+
+
+class NullPhaseTimer(PhaseTimer):
+    def phase(self, name: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        return iter(iterable)
+
+
+NULL_TIMER = NullPhaseTimer()
+
+
+def is_doctest_block(block: CodeBlock) -> bool:
+    return block.syntax in DOCTEST_SYNTAXES or block.source.startswith(
+        DOCTEST_PROMPT,
+    )
+
+
+def parse_named_blocks(
+    fp: Union[TextIO, Buffer],
+    filename: str,
+    prefix: str,
+    timer: PhaseTimer = NULL_TIMER,
+    doctest_flags: Optional[int] = None,
+) -> Iterator[LazyBlock]:
+    """
+    Parse code blocks named with ``prefix`` and collect their fixtures,
+    without compiling them. Buffers are parsed without decoding them
+    as a whole.
+
+    Unless ``doctest_flags`` is ``None`` all interactive examples are
+    collected too, the unnamed ones as ``doctest``.
+    """
+    interactive = doctest_flags is not None
+    blocks = (
+        parse_code_blocks_mapped(fp, interactive)
+        if isinstance(fp, (bytes, mmap.mmap))
+        else parse_code_blocks(fp, interactive)
+    )
+    for code_block in timer.iterate("parse", blocks):
+        params = dict(code_block.params)
+        test_name = params.get("name")
+
+        if interactive and is_doctest_block(code_block):
+            if not test_name or not test_name.startswith(prefix):
+                test_name = "doctest"
+            yield LazyBlock(
+                name=test_name,
+                block=code_block,
+                fixture_names=(),
+                filename=filename,
+                source=code_block.source,
+                doctest_flags=doctest_flags,
+            )
+            continue
+
+        if not test_name:
+            continue
+
+        if not test_name.startswith(prefix):
+            continue
+
+        fixtures_value = params.get("fixtures", "")
+        fixtures_found: set[str] = set(_parse_fixtures(fixtures_value))
+
+        # Scan for "# fixtures:" comments and strip them
+        filtered_lines = []
+        with timer.phase("fixtures"):
+            for line in code_block._split_lines():
+                match = COMMENT_FIXTURES_REGEXP.match(line.strip())
+                if match:
+                    fixtures_found.update(_parse_fixtures(match.group(1)))
                 else:
-                    yield RSTTestItem.from_parent(
-                        name=item_name,
-                        parent=self,
-                        code=code,
-                    )
+                    filtered_lines.append(line)
 
+        yield LazyBlock(
+            name=test_name,
+            block=code_block,
+            fixture_names=tuple(sorted(fixtures_found)),
+            filename=filename,
+            source="".join(f"{line}\n" for line in filtered_lines),
+        )
 
-def pytest_addoption(parser: pytest.Parser) -> None:
-    parser.addoption(
-        "--rst-prefix",
-        default="test_",
-        help="RST code-block name prefix",
+
+def compile_code_blocks(
+    fp: Union[TextIO, Buffer],
+    filename: str,
+    prefix: str,
+    timer: PhaseTimer = NULL_TIMER,
+    previous: Iterable[CompiledBlock] = (),
+    doctest_flags: Optional[int] = None,
+) -> List[CompiledBlock]:
+    """
+    Parse and compile named code blocks. Code objects of ``previous``
+    blocks, compiled from an earlier version of the same file, are reused
+    for blocks whose text did not change. Moved python blocks reuse them
+    with shifted line numbers, interactive examples are compiled again
+    since their line numbers are part of the code.
+    """
+    reusable = {
+        (item.block.syntax, item.block.source): item for item in previous
+    }
+    result = []
+    blocks = parse_named_blocks(fp, filename, prefix, timer, doctest_flags)
+    for parsed in blocks:
+        code_block = parsed.block
+        with timer.phase("compile"):
+            reused = reusable.get((code_block.syntax, code_block.source))
+            if reused is None:
+                code = parsed.compile_code()
+            elif reused.block.start_line == code_block.start_line:
+                code = reused.code
+            elif parsed.doctest_flags is not None:
+                code = parsed.compile_code()
+            else:
+                code = shift_code_lines(
+                    reused.code,
+                    code_block.start_line - reused.block.start_line,
+                )
+
+        result.append(
+            CompiledBlock(
+                name=parsed.name,
+                block=code_block,
+                fixture_names=parsed.fixture_names,
+                code=code,
+            ),
+        )
+    return result
+
+
+def pack_blocks(blocks: List[CompiledBlock]) -> Tuple:
+    """Convert compiled blocks to a value serializable by ``marshal``"""
+    return tuple(
+        (
+            item.name,
+            item.block.start_line,
+            item.block.params,
+            item.block.syntax,
+            item.block.source,
+            item.block.line_count,
+            item.block.directive_line,
+            item.fixture_names,
+            item.code,
+        )
+        for item in blocks
     )
 
 
-@pytest.hookimpl(trylast=True)
-def pytest_collect_file(
-    file_path: Path,
-    parent: pytest.Collector,
-) -> Optional[RSTModule]:
-    if file_path.suffix != ".rst":
-        return None
+def unpack_blocks(payload: Tuple) -> List[CompiledBlock]:
+    return [
+        CompiledBlock(
+            name=name,
+            block=CodeBlock.from_source(
+                start_line=start_line,
+                params=params,
+                syntax=syntax,
+                source=source,
+                line_count=line_count,
+                directive_line=directive_line,
+            ),
+            fixture_names=fixture_names,
+            code=code,
+        )
+        for (
+            name,
+            start_line,
+            params,
+            syntax,
+            source,
+            line_count,
+            directive_line,
+            fixture_names,
+            code,
+        ) in payload
+    ]
+
+
+class SourceFile(NamedTuple):
+    """
+    Content of an RST file, decoded as UTF-8 when parsed. A memory mapped
+    file stays open until ``close()``, or the end of a ``with`` block.
+    """
+
+    path: Path
+    mtime_ns: int
+    data: Buffer
+    digest: str
+
+    def __enter__(self) -> "SourceFile":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    @classmethod
+    def read(cls, path: Path, mapped: bool = False) -> "SourceFile":
+        """
+        Read the file, ``mapped`` files are memory mapped and parsed
+        without decoding anything but code blocks.
+        """
+        mtime_ns = path.stat().st_mtime_ns
+        data: Buffer = b""
+        if mapped:
+            with open(path, "rb") as fp:
+                try:
+                    data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty files can not be mapped
+                    pass
+        else:
+            data = path.read_bytes()
+        return cls(
+            path=path,
+            mtime_ns=mtime_ns,
+            data=data,
+            digest=hashlib.blake2b(data, digest_size=16).hexdigest(),
+        )
+
+    def parse(
+        self,
+        prefix: str,
+        timer: PhaseTimer = NULL_TIMER,
+        doctest_flags: Optional[int] = None,
+    ) -> List[LazyBlock]:
+        filename = str(self.path)
+        if isinstance(self.data, mmap.mmap):
+            return list(
+                parse_named_blocks(
+                    self.data,
+                    filename,
+                    prefix,
+                    timer,
+                    doctest_flags,
+                ),
+            )
+        with TextIOWrapper(BytesIO(self.data), encoding="utf-8") as fp:
+            return list(
+                parse_named_blocks(fp, filename, prefix, timer, doctest_flags),
+            )
+
+    def compile(
+        self,
+        prefix: str,
+        timer: PhaseTimer = NULL_TIMER,
+        previous: Iterable[CompiledBlock] = (),
+        doctest_flags: Optional[int] = None,
+    ) -> List[CompiledBlock]:
+        if isinstance(self.data, mmap.mmap):
+            return compile_code_blocks(
+                self.data,
+                str(self.path),
+                prefix,
+                timer,
+                previous,
+                doctest_flags,
+            )
+        with TextIOWrapper(BytesIO(self.data), encoding="utf-8") as fp:
+            return compile_code_blocks(
+                fp,
+                str(self.path),
+                prefix,
+                timer,
+                previous,
+                doctest_flags,
+            )
+
+
+def _compile_file_worker(
+    source: SourceFile,
+    prefix: str,
+    doctest_flags: Optional[int] = None,
+) -> bytes:
+    blocks = source.compile(prefix, doctest_flags=doctest_flags)
+    return marshal.dumps(pack_blocks(blocks))
+
+
+class CollectionCache:
+    """
+    Persistent store of compiled code blocks, one entry per RST file.
+
+    An entry is valid only while the file path, modification time,
+    content hash, plugin version, python bytecode magic and the
+    ``--rst-prefix`` and doctest option values all match the ones it was
+    written with.
+    """
+
+    FORMAT = 3
+    INDEX_KEY = "pytest-rst/collection-index"
+
+    def __init__(
+        self,
+        cache: pytest.Cache,
+        prefix: str,
+        doctest_flags: Optional[int] = None,
+    ):
+        self.cache = cache
+        self.prefix = prefix
+        self.doctest_flags = doctest_flags
+        self.index: Dict[str, str] = cache.get(self.INDEX_KEY, {})
+        # Created on first use, sessions without RST files leave no trace
+        self._directory: Optional[Path] = None
+
+    @property
+    def directory(self) -> Path:
+        if self._directory is None:
+            self._directory = self.cache.mkdir("pytest-rst")
+        return self._directory
+
+    @staticmethod
+    def entry_name(path: Path) -> str:
+        return hashlib.sha1(str(path).encode()).hexdigest()
+
+    def make_key(self, path: Path, mtime_ns: int, digest: str) -> Tuple:
+        return (
+            self.FORMAT,
+            PLUGIN_VERSION,
+            MAGIC_NUMBER,
+            self.prefix,
+            self.doctest_flags,
+            str(path),
+            mtime_ns,
+            digest,
+        )
+
+    def read(self, path: Path) -> Optional[Tuple[Tuple, Tuple]]:
+        entry = self.directory / self.entry_name(path)
+        try:
+            key, payload = marshal.loads(entry.read_bytes())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return key, payload
+
+    def load(
+        self,
+        path: Path,
+        mtime_ns: int,
+        digest: str,
+    ) -> Optional[List[CompiledBlock]]:
+        entry = self.read(path)
+        if entry is None:
+            return None
+
+        key, payload = entry
+        if key != self.make_key(path, mtime_ns, digest):
+            return None
+
+        return unpack_blocks(payload)
+
+    def load_previous(self, path: Path) -> List[CompiledBlock]:
+        """
+        Blocks cached for an older version of the file, their code objects
+        may be reused for blocks which are unchanged.
+        """
+        entry = self.read(path)
+        if entry is None:
+            return []
+
+        key, payload = entry
+        # Everything but modification time and content hash must match
+        if key[:-2] != self.make_key(path, 0, "")[:-2]:
+            return []
+
+        return unpack_blocks(payload)
+
+    def store(
+        self,
+        path: Path,
+        mtime_ns: int,
+        digest: str,
+        blocks: List[CompiledBlock],
+    ) -> None:
+        payload = pack_blocks(blocks)
+        name = self.entry_name(path)
+        data = marshal.dumps((self.make_key(path, mtime_ns, digest), payload))
+
+        # Write atomically, concurrent pytest processes may share the cache
+        tmp_path = self.directory / f"{name}.{os.getpid()}.tmp"
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, self.directory / name)
+        except OSError:
+            log.debug("Failed to write rst cache entry for %s", path)
+            return
+        self.index[name] = str(path)
+
+    def evict_stale(self) -> None:
+        if self._directory is None:
+            return
+        # Other processes sharing the cache may have written entries
+        self.index = {**self.cache.get(self.INDEX_KEY, {}), **self.index}
+        for entry in self.directory.iterdir():
+            # Entries being written by other processes
+            if entry.name.endswith(".tmp"):
+                continue
+            source = self.index.get(entry.name)
+            if source is not None and os.path.exists(source):
+                continue
+            self.index.pop(entry.name, None)
+            entry.unlink(missing_ok=True)
+        self.cache.set(self.INDEX_KEY, self.index)
+
+    def clear(self) -> None:
+        for entry in self.directory.iterdir():
+            entry.unlink(missing_ok=True)
+        self.index.clear()
+        self.cache.set(self.INDEX_KEY, self.index)
+
+
+COLLECTION_CACHE_KEY = pytest.StashKey[Optional[CollectionCache]]()
+DOCTEST_FLAGS_KEY = pytest.StashKey[Optional[int]]()
+
+
+def has_candidate_blocks(
+    path: Path,
+    prefix: str,
+    interactive: bool = False,
+    includes: bool = False,
+) -> bool:
+    """
+    Cheap check whether the file may contain collectable code blocks.
+
+    The file is memory mapped and searched for the ``code-block::``
+    directive and the name prefix, or the ``>>>`` prompt with
+    ``interactive``, or the ``include::`` directive with ``includes``,
+    without decoding it.
+    Files failing the check are guaranteed to produce no test items.
+    """
+    with open(path, "rb") as fp:
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            return False
+        with mm:
+            if interactive and mm.find(DOCTEST_PROMPT.encode()) >= 0:
+                return True
+            if includes and mm.find(INCLUDE_DIRECTIVE) >= 0:
+                return True
+            if mm.find(b"code-block::") < 0:
+                return False
+            return mm.find(prefix.encode()) >= 0
+
+
+INCLUDE_DIRECTIVE = b".. include::"
+INCLUDE_REGEXP = re.compile(
+    rb"^[ \t]*\.\. include::[ \t]*(?P<path>[^\r\n]*?)[ \t]*\r?$"
+    rb"(?P<options>(?:\r?\n[ \t]+:[^\r\n]*)*)",
+    re.MULTILINE,
+)
+# Options including the file as a literal block instead of RST
+LITERAL_INCLUDE_OPTIONS = (b":literal:", b":code:", b":parser:")
+
+
+def find_includes(source: SourceFile) -> List[Path]:
+    """
+    Files included by RST ``include`` directives of the file, relative
+    paths are resolved against its directory. Standard docutils includes
+    like ``<isonum.txt>`` and literal includes are skipped.
+    """
+    result = []
+    for match in INCLUDE_REGEXP.finditer(source.data):
+        options = match.group("options")
+        if any(option in options for option in LITERAL_INCLUDE_OPTIONS):
+            continue
+        name = match.group("path").decode()
+        if not name or name.startswith("<"):
+            continue
+        result.append((source.path.parent / name).resolve())
+    return result
+
+
+def discover_rst_files(config: pytest.Config) -> Iterator[Path]:
+    """
+    Find RST files the session is going to collect, honouring
+    ``norecursedirs`` and ``--ignore``. The result is a superset
+    of what pytest collects, it is used only to schedule work early.
+    """
+    norecursedirs = config.getini("norecursedirs")
+    ignored = {
+        Path(p).resolve() for p in (config.getoption("ignore") or ())
+    }
+    root = config.invocation_params.dir
+
+    for arg in config.args:
+        path = (root / arg.split("::", 1)[0]).resolve()
+        if path.is_file():
+            if path.suffix == ".rst":
+                yield path
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(
+                name
+                for name in dirnames
+                if not any(fnmatch(name, p) for p in norecursedirs)
+                and Path(dirpath, name) not in ignored
+            )
+            for name in sorted(filenames):
+                if name.endswith(".rst"):
+                    yield Path(dirpath, name)
+
+
+class ParallelCompiler:
+    """
+    Parses and compiles RST files in a process pool ahead of collection.
+    Results are handed over to ``RSTModule`` as soon as they are ready.
+
+    Files are read and hashed once, by the caller, and workers get their
+    content along with the digest.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        prefix: str,
+        doctest_flags: Optional[int] = None,
+    ):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.prefix = prefix
+        self.doctest_flags = doctest_flags
+        self.futures: Dict[Path, Tuple[SourceFile, "Future[bytes]"]] = {}
+
+    def submit(self, source: SourceFile) -> None:
+        future = self.executor.submit(
+            _compile_file_worker,
+            source,
+            self.prefix,
+            self.doctest_flags,
+        )
+        self.futures[source.path.resolve()] = (source, future)
+
+    def source(self, path: Path) -> Optional[SourceFile]:
+        """Submitted content of the file, unless it was modified since"""
+        submitted = self.futures.get(path.resolve())
+        if submitted is None:
+            return None
+        source = submitted[0]
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return source if mtime_ns == source.mtime_ns else None
+
+    def result(self, source: SourceFile) -> Optional[List[CompiledBlock]]:
+        submitted = self.futures.pop(source.path.resolve(), None)
+        if submitted is None:
+            return None
+
+        if submitted[0].digest != source.digest:
+            # The file was changed after it has been submitted
+            return None
+        return unpack_blocks(marshal.loads(submitted[1].result()))
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.futures.clear()
+
+
+PARALLEL_COMPILER_KEY = pytest.StashKey[Optional[ParallelCompiler]]()
+
+
+class CollectionProfiler:
+    """
+    Collects per file phase timings and, optionally, a cProfile
+    profile of the whole collection.
+    """
+
+    def __init__(self, report_path: str, cprofile_path: Optional[str]):
+        self.report_path = report_path
+        self.cprofile_path = cprofile_path
+        self.timers: Dict[str, PhaseTimer] = {}
+        self.profile: Optional["cProfile.Profile"] = None
+        if cprofile_path:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+        self.started = 0.0
+        self.duration = 0.0
+
+    def timer(self, name: str) -> PhaseTimer:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = PhaseTimer()
+        return timer
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self) -> None:
+        if self.profile is not None:
+            self.profile.disable()
+        self.duration += time.perf_counter() - self.started
+
+    def report(self) -> Dict[str, Any]:
+        totals: Dict[str, float] = {}
+        for timer in self.timers.values():
+            for name, value in timer.phases.items():
+                totals[name] = totals.get(name, 0.0) + value
+        return {
+            "plugin_version": PLUGIN_VERSION,
+            "collection_seconds": self.duration,
+            "files": {
+                name: timer.phases for name, timer in self.timers.items()
+            },
+            "totals": totals,
+        }
+
+    def write(self) -> None:
+        with open(self.report_path, "w") as fp:
+            json.dump(self.report(), fp, indent=2, sort_keys=True)
+        if self.profile is not None and self.cprofile_path:
+            self.profile.dump_stats(self.cprofile_path)
+
+
+COLLECTION_PROFILER_KEY = pytest.StashKey[Optional[CollectionProfiler]]()
+
+
+class GitChanges:
+    """
+    RST files changed since a git reference, including uncommitted and
+    untracked ones, with line ranges of the changes.
+    """
+
+    HUNK_REGEXP = re.compile(
+        r"^@@ -\d+(?:,\d+)? \+(?P<start>\d+)(?:,(?P<count>\d+))? @@",
+    )
+
+    def __init__(self, cwd: Path, ref: str):
+        self.ref = ref
+        self.root = Path(self.git(cwd, "rev-parse", "--show-toplevel").strip())
+        # Changed line ranges (1-based, inclusive), None when the whole
+        # file is new.
+        self.files: Dict[Path, Optional[List[Tuple[int, int]]]] = {}
+
+        diff = self.git(
+            self.root,
+            "diff",
+            "-U0",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            ref,
+            "--",
+            "*.rst",
+        )
+        self.parse_diff(diff)
+
+        untracked = self.git(
+            self.root,
+            "ls-files",
+            "--others",
+            "--exclude-standard",
+            "-z",
+            "--",
+            "*.rst",
+        )
+        for name in filter(None, untracked.split("\0")):
+            self.files[self.root / name] = None
+
+    @staticmethod
+    def git(cwd: Path, *args: str) -> str:
+        import subprocess
+
+        try:
+            process = subprocess.run(
+                ["git", *args],
+                cwd=cwd,
+                capture_output=True,
+                text=True,
+            )
+        except OSError as e:
+            raise pytest.UsageError(f"Can not run git: {e}") from e
+        if process.returncode:
+            raise pytest.UsageError(
+                f"git {args[0]} failed: {process.stderr.strip()}",
+            )
+        return process.stdout
+
+    def parse_diff(self, diff: str) -> None:
+        ranges: Optional[List[Tuple[int, int]]] = None
+        for line in diff.splitlines():
+            if line.startswith("+++ "):
+                ranges = None
+                if line.startswith("+++ b/"):
+                    ranges = []
+                    self.files[self.root / line[6:]] = ranges
+                continue
+
+            match = self.HUNK_REGEXP.match(line)
+            if match is None or ranges is None:
+                continue
+
+            start = int(match.group("start"))
+            count = int(match.group("count") or 1)
+            # Pure deletions are attributed to the line above
+            ranges.append((start, start + max(count, 1) - 1))
+
+    def is_changed(self, path: Path) -> bool:
+        return path.resolve() in self.files
+
+    def intersects(self, path: Path, first: int, last: int) -> bool:
+        """Check the lines ``first``..``last`` (1-based) were changed"""
+        if path.resolve() not in self.files:
+            return False
+        ranges = self.files[path.resolve()]
+        if ranges is None:
+            return True
+        return any(start <= last and first <= end for start, end in ranges)
+
+
+GIT_CHANGES_KEY = pytest.StashKey[Optional[GitChanges]]()
+
+
+def extract_imports(code: CodeType) -> Tuple[str, ...]:
+    """
+    Absolute names of modules imported by the code object and all nested
+    ones. Bytecode is inspected rather than the AST, so this works for
+    code objects loaded from the collection cache too.
+    """
+    found: Set[str] = set()
+    pending = [code]
+    while pending:
+        current = pending.pop()
+        for instruction in dis.get_instructions(current):
+            if instruction.opname == "IMPORT_NAME" and instruction.argval:
+                found.add(instruction.argval)
+        pending.extend(
+            const for const in current.co_consts if isinstance(const, CodeType)
+        )
+    return tuple(sorted(found))
+
+
+def path_to_modules(path: Path, roots: Iterable[Path]) -> Set[str]:
+    """Names the python source file may be imported as"""
+    if path.suffix not in (".py", ".pyi"):
+        return set()
+
+    result = set()
+    for root in roots:
+        try:
+            parts = list(path.with_suffix("").relative_to(root).parts)
+        except ValueError:
+            continue
+        if parts and parts[-1] == "__init__":
+            parts.pop()
+        if parts and all(part.isidentifier() for part in parts):
+            result.add(".".join(parts))
+    return result
+
+
+def modules_intersect(imported: str, changed: str) -> bool:
+    # Importing a.b.c executes a and a.b, importing a may import a.b.c
+    return (
+        imported == changed
+        or imported.startswith(changed + ".")
+        or changed.startswith(imported + ".")
+    )
+
+
+class AffectedBy:
+    """Selects blocks importing any of the changed python modules"""
+
+    def __init__(self, paths: Iterable[Path], roots: Iterable[Path]):
+        roots = [root.resolve() for root in roots]
+        self.paths = {path.resolve() for path in paths}
+        self.modules: Set[str] = set()
+        for path in self.paths:
+            self.modules.update(path_to_modules(path, roots))
+
+    def is_affected(self, item: pytest.Item) -> bool:
+        if item.path.resolve() in self.paths:
+            return True
+        if RST_IMPORTS_KEY not in item.stash:
+            try:
+                compiled_block(item)
+            except SyntaxError:
+                # Let the block run and report the error
+                return True
+        return any(
+            modules_intersect(imported, changed)
+            for imported in item.stash[RST_IMPORTS_KEY]
+            for changed in self.modules
+        )
+
+
+IMPORTS_INDEX_KEY = "pytest-rst/imports"
+
+
+class CollectionStats:
+    def __init__(self) -> None:
+        self.files_seen = 0
+        self.files_skipped = 0
+        self.files_unchanged = 0
+
+
+COLLECTION_STATS_KEY = pytest.StashKey[CollectionStats]()
+
+
+class ResourceUsage:
+    def __init__(self) -> None:
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory: Optional[int] = None
+
+
+@contextmanager
+def measure_usage(trace_memory: bool) -> Iterator[ResourceUsage]:
+    """
+    Measure wall time, CPU time and optionally the peak of memory allocated
+    by the code running inside the context. The result is filled on exit.
+    """
+    usage = ResourceUsage()
+    started_tracing = False
+    baseline = 0
+    if trace_memory:
+        if tracemalloc.is_tracing():
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            started_tracing = True
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        yield usage
+    finally:
+        usage.wall_time = time.perf_counter() - wall_started
+        usage.cpu_time = time.process_time() - cpu_started
+        if trace_memory:
+            usage.peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+            if started_tracing:
+                tracemalloc.stop()
+
+
+class BlockMeasurement(NamedTuple):
+    path: str
+    name: str
+    start_line: int
+    end_line: int
+    usage: ResourceUsage
+
+
+BLOCK_MEASUREMENTS_KEY = pytest.StashKey[List[BlockMeasurement]]()
+DURATIONS_KEY = "pytest-rst/durations"
+SESSION_DURATIONS_KEY = pytest.StashKey[Dict[str, float]]()
+
+
+class DurationRecorder:
+    """Sums durations of all phases of RST items by node id"""
+
+    def __init__(self, durations: Dict[str, float]):
+        self.durations = durations
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        # Reports of pytest-xdist workers are replayed on the controller
+        if report.nodeid.split("::", 1)[0].endswith(".rst"):
+            self.durations[report.nodeid] = (
+                self.durations.get(report.nodeid, 0.0) + report.duration
+            )
+
+
+class Sharding:
+    """
+    Split RST items into ``count`` shards of similar total duration.
+    Durations of previous runs are used when known, otherwise blocks
+    are weighted by their line count. Blocks sharing a namespace are
+    kept in the same shard.
+    """
+
+    def __init__(self, index: int, count: int, durations: Dict[str, float]):
+        self.index = index
+        self.count = count
+        self.durations = durations
+        self.predicted: List[float] = [0.0] * count
+        self.selected: Set[str] = set()
+        # Predictions are in seconds when any duration is known
+        self.timed = False
+
+    @classmethod
+    def parse(cls, value: str) -> Tuple[int, int]:
+        index, _, count = value.partition("/")
+        try:
+            result = int(index), int(count)
+        except ValueError:
+            result = (0, 0)
+        if not 1 <= result[0] <= result[1]:
+            raise pytest.UsageError(
+                f"--rst-shard expects INDEX/COUNT with 1 <= INDEX <= COUNT, "
+                f"got {value!r}",
+            )
+        return result
+
+    @staticmethod
+    def lines(item: pytest.Item) -> int:
+        return item.stash[RST_BLOCK_KEY].block.line_count + 1
+
+    def estimate(self, items: List[pytest.Item]) -> Dict[str, float]:
+        known = [item for item in items if item.nodeid in self.durations]
+        self.timed = bool(known)
+        per_line = 1.0
+        if known:
+            known_lines = sum(self.lines(item) for item in known)
+            per_line = (
+                sum(self.durations[item.nodeid] for item in known)
+                / known_lines
+            )
+        return {
+            item.nodeid: self.durations.get(
+                item.nodeid,
+                self.lines(item) * per_line,
+            )
+            for item in items
+        }
+
+    def split(self, items: List[pytest.Item]) -> None:
+        items = [item for item in items if RST_BLOCK_KEY in item.stash]
+        weights = self.estimate(items)
+
+        units: Dict[Tuple[str, str], List[pytest.Item]] = {}
+        for item in items:
+            session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+            key = (
+                (item.nodeid.split("::", 1)[0], session)
+                if session is not None
+                else (item.nodeid, "")
+            )
+            units.setdefault(key, []).append(item)
+
+        # Longest processing time first: the heaviest unit goes to the
+        # least loaded shard, ties are broken by node id and shard index
+        # so every CI node computes the same split.
+        ordered = sorted(
+            units.items(),
+            key=lambda unit: (
+                -sum(weights[item.nodeid] for item in unit[1]),
+                unit[0],
+            ),
+        )
+        for _, unit in ordered:
+            shard = min(range(self.count), key=lambda i: self.predicted[i])
+            self.predicted[shard] += sum(weights[i.nodeid] for i in unit)
+            if shard == self.index - 1:
+                self.selected.update(item.nodeid for item in unit)
+
+    def format(self, value: float) -> str:
+        return f"{value:.2f}s" if self.timed else f"{value:.0f} lines"
+
+
+SHARDING_KEY = pytest.StashKey[Optional[Sharding]]()
+RST_BLOCK_KEY = pytest.StashKey[Union[CompiledBlock, LazyBlock]]()
+RST_IMPORTS_KEY = pytest.StashKey[Tuple[str, ...]]()
+
+
+def compiled_block(item: pytest.Item) -> CompiledBlock:
+    """
+    Compiled block of an RST item, compiling it first when the item was
+    collected lazily. Wrappers of blocks with fixtures get the code bound.
+    """
+    block = item.stash[RST_BLOCK_KEY]
+    if isinstance(block, CompiledBlock):
+        return block
+
+    compiled = block.compile()
+    if isinstance(item, pytest.Function):
+        item.obj.__globals__["__rst_code__"] = compiled.code
+    item.stash[RST_BLOCK_KEY] = compiled
+    item.stash[RST_IMPORTS_KEY] = extract_imports(compiled.code)
+    return compiled
+
+
+SHARED_NAMESPACE_KEY = pytest.StashKey[str]()
+# Resolved paths of RST files collected so far with --rst-follow-includes
+COLLECTED_FILES_KEY = pytest.StashKey[Set[Path]]()
+# Interactive examples of a file share a namespace, as doctest files do
+DOCTEST_SESSION = "doctest"
+
+
+class IsolatedBlockError(Exception):
+    """Code block failed in an isolated worker process"""
+
+
+def _max_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _process_rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as fp:
+            return int(fp.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _isolated_worker(conn: "Connection", preload: Tuple[str, ...]) -> None:
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            log.warning("Failed to preload module %r", module)
+
+    event_loop = BlockEventLoop()
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except EOFError:
+            event_loop.close()
+            return
+
+        code = marshal.loads(data)
+        try:
+            event_loop.run(code, new_namespace())
+        except pytest.skip.Exception as e:
+            # Skips and expected failures are raised again by the parent
+            conn.send(("skipped", e.msg, _max_rss()))
+        except pytest.xfail.Exception as e:
+            conn.send(("xfailed", e.msg, _max_rss()))
+        except BaseException as e:
+            # Skip worker and event loop frames, the traceback starts
+            # with the block code
+            tb = e.__traceback__
+            while tb is not None and (
+                tb.tb_frame.f_code.co_filename != code.co_filename
+            ):
+                tb = tb.tb_next
+            text = "".join(
+                traceback.format_exception(type(e), e, tb or e.__traceback__),
+            )
+            conn.send(("failed", text, _max_rss()))
+        else:
+            conn.send(("passed", "", _max_rss()))
+
+
+IsolatedContext = Union["SpawnContext", "ForkServerContext"]
+
+
+class IsolatedWorker:
+    def __init__(
+        self,
+        context: IsolatedContext,
+        preload: Tuple[str, ...] = (),
+    ):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_isolated_worker,
+            args=(child_conn, preload),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.blocks = 0
+        self.broken = False
+
+    def kill(self) -> None:
+        self.broken = True
+        self.process.kill()
+        self.process.join()
+
+    def crashed(self) -> NoReturn:
+        self.broken = True
+        self.process.join(timeout=5)
+        raise IsolatedBlockError(
+            f"Worker process exited with code "
+            f"{self.process.exitcode} while running the block",
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+
+    def run(
+        self,
+        code: CodeType,
+        timeout: Optional[float],
+        max_rss: Optional[int],
+    ) -> None:
+        self.blocks += 1
+        try:
+            self.conn.send_bytes(marshal.dumps(code))
+        except OSError:
+            self.crashed()
+        deadline = time.monotonic() + timeout if timeout else None
+
+        while not self.conn.poll(0.05):
+            if not self.process.is_alive():
+                self.crashed()
+            if deadline is not None and time.monotonic() > deadline:
+                self.kill()
+                raise IsolatedBlockError(f"Timeout after {timeout}s")
+            rss = _process_rss(self.process.pid or 0) if max_rss else None
+            if max_rss and rss is not None and rss > max_rss:
+                self.kill()
+                raise IsolatedBlockError(
+                    f"Worker RSS {rss} exceeds the limit of {max_rss} bytes",
+                )
+
+        try:
+            outcome, text, rss = self.conn.recv()
+        except (EOFError, OSError):
+            self.crashed()
+        if max_rss and rss is not None and rss > max_rss:
+            self.broken = True
+            raise IsolatedBlockError(
+                f"Worker RSS {rss} exceeds the limit of {max_rss} bytes",
+            )
+        if outcome == "skipped":
+            # Reported at the block, not at this frame, as skip marks are
+            raise pytest.skip.Exception(text, _use_item_location=True)
+        if outcome == "xfailed":
+            pytest.xfail(text)
+        if outcome == "failed":
+            raise IsolatedBlockError(text)
+
+
+class IsolatedPool:
+    """
+    Pool of reusable worker processes executing code blocks. A worker
+    is replaced after a timeout, a crash, exceeding the memory limit
+    or executing ``max_blocks`` blocks.
+
+    The ``forkserver`` backend forks every worker from a server process
+    which has already imported the ``preload`` modules, and runs a
+    single block per worker.
+    """
+
+    BACKENDS = ("spawn", "forkserver")
+
+    def __init__(
+        self,
+        size: int,
+        timeout: Optional[float] = None,
+        max_rss: Optional[int] = None,
+        max_blocks: int = 0,
+        backend: str = "spawn",
+        preload: Iterable[str] = (),
+    ):
+        import multiprocessing
+
+        self.context: IsolatedContext
+        self.preload = tuple(preload)
+        if backend == "forkserver":
+            self.context = multiprocessing.get_context("forkserver")
+            self.context.set_forkserver_preload([__name__, *self.preload])
+            max_blocks = 1
+        else:
+            self.context = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.max_blocks = max_blocks
+        self.workers: List[IsolatedWorker] = []
+        self.idle: "queue.Queue[IsolatedWorker]" = queue.Queue()
+        for _ in range(size):
+            self.idle.put(self.start_worker())
+
+    def start_worker(self) -> IsolatedWorker:
+        worker = IsolatedWorker(self.context, self.preload)
+        self.workers.append(worker)
+        return worker
+
+    def replace_worker(self, worker: IsolatedWorker) -> IsolatedWorker:
+        worker.close()
+        self.workers.remove(worker)
+        return self.start_worker()
+
+    def run(self, code: CodeType) -> None:
+        worker = self.idle.get()
+        try:
+            worker.run(code, self.timeout, self.max_rss)
+        finally:
+            if worker.broken or (
+                self.max_blocks and worker.blocks >= self.max_blocks
+            ):
+                worker = self.replace_worker(worker)
+            self.idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+        self.workers.clear()
+
+
+ISOLATED_POOL_KEY = pytest.StashKey[Optional[IsolatedPool]]()
+EVENT_LOOP_KEY = pytest.StashKey[BlockEventLoop]()
+ITEM_POSITIONS_KEY = pytest.StashKey[Dict[pytest.Item, int]]()
+
+
+def item_positions(session: pytest.Session) -> Dict[pytest.Item, int]:
+    """
+    Positions of the items in the run order. Built on the first use, when
+    the tests are running and every plugin is done reordering them.
+    """
+    positions = session.stash.get(ITEM_POSITIONS_KEY, None)
+    if positions is None:
+        positions = {item: i for i, item in enumerate(session.items)}
+        session.stash[ITEM_POSITIONS_KEY] = positions
+    return positions
+
+
+def following_items(
+    item: pytest.Item,
+    predicate: Callable[[pytest.Item], bool],
+    limit: Optional[int] = None,
+) -> List[pytest.Item]:
+    """
+    Return ``item`` and at most ``limit`` items in total selected to run
+    after it from the same file, up to an item of another file, matching
+    the ``predicate``.
+    """
+    items = item.session.items
+    start = item_positions(item.session).get(item, len(items))
+    result = [item]
+    for other in items[start + 1:]:
+        if limit is not None and len(result) >= limit:
+            break
+        if other.parent is not item.parent:
+            break
+        if predicate(other):
+            result.append(other)
+    return result
+
+
+def can_run_ahead(session: pytest.Session) -> bool:
+    """
+    Check blocks may run before pytest gets to them, which is not the case
+    once the session is stopping or when it stops at the first failures.
+    """
+    return not (
+        session.shouldfail
+        or session.shouldstop
+        or session.config.getoption("maxfail")
+    )
+
+
+# Buffers of the output of the block run ahead in this thread or task
+BLOCK_OUTPUT: ContextVar[Optional[Tuple[StringIO, StringIO]]] = ContextVar(
+    "BLOCK_OUTPUT",
+    default=None,
+)
+
+
+class BlockOutputStream:
+    """
+    Wraps ``sys.stdout`` or ``sys.stderr``, the output of a block run
+    ahead is written to its own buffer
+    """
+
+    def __init__(self, stream: TextIO, index: int):
+        self.stream = stream
+        self.index = index
+
+    def write(self, text: str) -> int:
+        buffers = BLOCK_OUTPUT.get()
+        if buffers is None:
+            return self.stream.write(text)
+        return buffers[self.index].write(text)
+
+    def writelines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def redirect_block_output() -> Iterator[None]:
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = BlockOutputStream(stdout, 0)
+    sys.stderr = BlockOutputStream(stderr, 1)
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+class BlockOutcome(NamedTuple):
+    """Exception and output of a block run ahead"""
+
+    exception: Optional[BaseException]
+    stdout: str
+    stderr: str
+
+    def replay(self) -> None:
+        """Write the output of the block and raise its exception"""
+        sys.stdout.write(self.stdout)
+        sys.stderr.write(self.stderr)
+        if self.exception is not None:
+            raise self.exception
+
+
+def run_captured(function: Callable[[], Any]) -> BlockOutcome:
+    buffers = (StringIO(), StringIO())
+    token = BLOCK_OUTPUT.set(buffers)
+    exception: Optional[BaseException] = None
+    try:
+        function()
+    except BaseException as e:
+        exception = e
+    finally:
+        BLOCK_OUTPUT.reset(token)
+    return BlockOutcome(exception, *(b.getvalue() for b in buffers))
+
+
+async def run_captured_async(
+    function: Callable[[], Awaitable[Any]],
+) -> BlockOutcome:
+    buffers = (StringIO(), StringIO())
+    # Tasks run in a copy of the context, the buffers are their own
+    BLOCK_OUTPUT.set(buffers)
+    exception: Optional[BaseException] = None
+    try:
+        await function()
+    except BaseException as e:
+        exception = e
+    return BlockOutcome(exception, *(b.getvalue() for b in buffers))
+
+
+class BlockThreadPool:
+    """
+    Runs independent code blocks in a thread pool. The first block of
+    a batch runs up to ``workers`` following blocks of the same file and
+    keeps their outcomes and output until pytest gets to them.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor: Optional["ThreadPoolExecutor"] = None
+        self.results: Dict[pytest.Item, BlockOutcome] = {}
+
+    def run(self, item: "RSTTestItem") -> None:
+        if item not in self.results:
+            batch: List[pytest.Item] = [item]
+            if can_run_ahead(item.session):
+                batch = following_items(
+                    item,
+                    lambda other: isinstance(other, RSTTestItem)
+                    and other.threaded
+                    and other not in self.results,
+                    limit=self.workers,
+                )
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="pytest-rst",
+                )
+            # The whole batch runs while pytest captures the output of
+            # the first block, each block writes to its own buffers
+            with redirect_block_output():
+                futures = [
+                    (other, self.executor.submit(run_captured, other.execute))
+                    for other in batch
+                    if isinstance(other, RSTTestItem)
+                ]
+                for other, future in futures:
+                    self.results[other] = future.result()
+
+        self.results.pop(item).replay()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.results.clear()
+
+
+THREAD_POOL_KEY = pytest.StashKey[Optional[BlockThreadPool]]()
+
+
+class RSTTestItem(pytest.Item):
+    def __init__(
+        self,
+        name: str,
+        parent: "RSTModule",
+        namespace: Callable[[], Dict[str, Any]] = new_namespace,
+        parallel: bool = False,
+    ):
+        super().__init__(name=name, parent=parent)
+        self.rst_module = parent
+        self.namespace = namespace
+        self.parallel = parallel
+
+    @property
+    def module(self) -> CodeType:
+        return compiled_block(self).code
+
+    @property
+    def concurrent(self) -> bool:
+        return (
+            self.config.getoption("--rst-async-concurrent")
+            and is_async_code(self.module)
+            and SHARED_NAMESPACE_KEY not in self.stash
+            and self.config.stash.get(ISOLATED_POOL_KEY, None) is None
+        )
+
+    @property
+    def threaded(self) -> bool:
+        return (
+            self.parallel
+            and not is_async_code(self.module)
+            and SHARED_NAMESPACE_KEY not in self.stash
+            and self.config.stash.get(ISOLATED_POOL_KEY, None) is None
+            and self.config.stash.get(THREAD_POOL_KEY, None) is not None
+        )
+
+    def reportinfo(self) -> Tuple[Path, Optional[int], str]:
+        return self.path, self.stash[RST_BLOCK_KEY].block.directive_line, ""
+
+    def execute(self) -> None:
+        self.rst_module.event_loop.run(self.module, self.namespace())
+
+    async def execute_async(self) -> None:
+        await eval(self.module, self.namespace())
+
+    def runtest(self) -> None:
+        pool = self.config.stash.get(ISOLATED_POOL_KEY, None)
+        # Blocks sharing a namespace must run in this process
+        if pool is not None and SHARED_NAMESPACE_KEY not in self.stash:
+            pool.run(self.module)
+            return
+        if self.concurrent:
+            self.rst_module.run_concurrently(self)
+            return
+        thread_pool = self.config.stash.get(THREAD_POOL_KEY, None)
+        if thread_pool is not None and self.threaded:
+            thread_pool.run(self)
+            return
+        self.execute()
+
+    def repr_failure(
+        self,
+        excinfo: pytest.ExceptionInfo[BaseException],
+        style: Optional[Any] = None,
+    ) -> Any:
+        if isinstance(excinfo.value, IsolatedBlockError):
+            return str(excinfo.value)
+        if isinstance(excinfo.value, DocTestMismatch):
+            return (
+                f"{self.location[0]}:{excinfo.value.lineno}: "
+                f"output mismatch\n{excinfo.value.message}"
+            )
+        return super().repr_failure(excinfo, style)
+
+
+class RSTModule(pytest.Module):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Namespaces shared by blocks of the same ``:session:``
+        self.namespaces: Dict[str, Dict[str, Any]] = {}
+        # Shared namespace name to the name of the block failed in it
+        self.failed_sessions: Dict[str, str] = {}
+        # Outcomes of asynchronous blocks executed concurrently
+        self.async_results: Dict[RSTTestItem, BlockOutcome] = {}
+        self.event_loop = self.config.stash[EVENT_LOOP_KEY]
+        if self.config.getoption("--rst-event-loop-scope") == "module":
+            self.event_loop = BlockEventLoop()
+        # Source and items of a file collected with --rst-lazy-compile,
+        # cached once all of its blocks have been compiled
+        self.lazy_source: Optional[SourceFile] = None
+        self.lazy_blocks = 0
+        self.lazy_items: List[pytest.Item] = []
+        # Files included by this one, with --rst-follow-includes
+        self.includes: List[Path] = []
+
+    def get_namespace(self, session: str) -> Dict[str, Any]:
+        namespace = self.namespaces.get(session)
+        if namespace is None:
+            namespace = self.namespaces[session] = new_namespace()
+        return namespace
+
+    def teardown(self) -> None:
+        self.namespaces.clear()
+        self.failed_sessions.clear()
+        self.async_results.clear()
+        if self.event_loop is not self.config.stash[EVENT_LOOP_KEY]:
+            self.event_loop.close()
+        self.store_lazy_blocks()
+
+    def store_lazy_blocks(self) -> None:
+        cache = self.config.stash.get(COLLECTION_CACHE_KEY, None)
+        source = self.lazy_source
+        if cache is None or source is None:
+            return
+        blocks = [item.stash[RST_BLOCK_KEY] for item in self.lazy_items]
+        compiled = [b for b in blocks if isinstance(b, CompiledBlock)]
+        if len(compiled) == self.lazy_blocks:
+            cache.store(source.path, source.mtime_ns, source.digest, compiled)
+            self.lazy_source = None
+
+    def run_concurrently(self, item: RSTTestItem) -> None:
+        """
+        Run ``item`` together with all following asynchronous blocks
+        of this file as tasks of the same event loop, the outcomes and
+        output are reported when pytest gets to the remaining items.
+        """
+        if item not in self.async_results:
+            batch = [item]
+            if can_run_ahead(self.session):
+                batch = [
+                    other
+                    for other in following_items(
+                        item,
+                        lambda other: isinstance(other, RSTTestItem)
+                        and other.rst_module is self
+                        and other.concurrent
+                        and other not in self.async_results,
+                    )
+                    if isinstance(other, RSTTestItem)
+                ]
+
+            import asyncio
+
+            async def gather() -> List[BlockOutcome]:
+                return await asyncio.gather(
+                    *(run_captured_async(i.execute_async) for i in batch),
+                )
+
+            with redirect_block_output():
+                results = self.event_loop.get().run_until_complete(gather())
+            self.async_results.update(zip(batch, results))
+
+        self.async_results.pop(item).replay()
+
+    def compile_blocks(
+        self,
+        timer: PhaseTimer = NULL_TIMER,
+    ) -> Sequence[Union[CompiledBlock, LazyBlock]]:
+        prefix = self.config.getoption("--rst-prefix")
+        doctest_flags = self.config.stash[DOCTEST_FLAGS_KEY]
+        cache = self.config.stash.get(COLLECTION_CACHE_KEY, None)
+        compiler = self.config.stash.get(PARALLEL_COMPILER_KEY, None)
+
+        with timer.phase("io"):
+            source = None
+            if compiler is not None:
+                # Read and hashed already when it was submitted
+                source = compiler.source(Path(self.fspath))
+            if source is None:
+                source = SourceFile.read(
+                    Path(self.fspath),
+                    mapped=self.config.getoption("--rst-mmap"),
+                )
+
+        # Blocks hold decoded copies, the file is not needed past here
+        with source:
+            if self.config.getoption("--rst-follow-includes"):
+                with timer.phase("includes"):
+                    self.includes = find_includes(source)
+
+            if cache is not None:
+                with timer.phase("cache"):
+                    blocks = cache.load(
+                        source.path,
+                        source.mtime_ns,
+                        source.digest,
+                    )
+                if blocks is not None:
+                    return blocks
+
+            blocks = None
+            if compiler is not None:
+                with timer.phase("workers"):
+                    blocks = compiler.result(source)
+            elif self.config.getoption("--rst-lazy-compile"):
+                lazy_blocks = source.parse(prefix, timer, doctest_flags)
+                self.lazy_source = source
+                self.lazy_blocks = len(lazy_blocks)
+                return lazy_blocks
+            if blocks is None:
+                previous: List[CompiledBlock] = []
+                if cache is not None:
+                    with timer.phase("cache"):
+                        previous = cache.load_previous(source.path)
+                blocks = source.compile(prefix, timer, previous, doctest_flags)
+
+            if cache is not None:
+                with timer.phase("cache"):
+                    cache.store(
+                        source.path,
+                        source.mtime_ns,
+                        source.digest,
+                        blocks,
+                    )
+            return blocks
+
+    def parallel_by_default(self) -> bool:
+        patterns = self.config.getini("rst_parallel")
+        path = Path(self.fspath)
+        try:
+            relative = path.relative_to(self.config.rootpath).as_posix()
+        except ValueError:
+            relative = path.as_posix()
+        return any(
+            fnmatch(relative, pattern) or fnmatch(path.name, pattern)
+            for pattern in patterns
+        )
+
+    def xdist_group(self, session: Optional[str]) -> Optional[str]:
+        """
+        Name of the pytest-xdist ``--dist loadgroup`` group for a block.
+        Blocks sharing a namespace must always run on the same worker.
+        """
+        if not self.config.pluginmanager.hasplugin("xdist"):
+            return None
+        path = self.nodeid.split("::", 1)[0]
+        if self.config.getoption("--rst-xdist-group") == "file":
+            return path
+        if session is not None:
+            return f"{path}::{session}"
+        return None
+
+    def selected_names(self) -> Optional[Set[str]]:
+        """
+        Block names selected by node id arguments pointing into this
+        file, ``None`` when the whole file is collected.
+        """
+        names: Set[str] = set()
+        root = self.config.invocation_params.dir
+        path = Path(self.fspath).resolve()
+        for arg in self.config.args:
+            arg_path, separator, rest = arg.partition("::")
+            target = (root / arg_path).resolve()
+            if target == path:
+                if not separator:
+                    return None
+                names.add(rest.split("::", 1)[0])
+            elif target in path.parents:
+                return None
+        return names or None
+
+    def keyword_matcher(self) -> Optional[Callable[[pytest.Item], bool]]:
+        """
+        Match items against ``-k`` the way pytest does, ``None`` without
+        an expression or when pytest no longer provides the private API.
+        """
+        keyword = (self.config.getoption("keyword") or "").strip()
+        if not keyword:
+            return None
+        try:
+            from _pytest.mark import KeywordMatcher
+            from _pytest.mark.expression import Expression
+
+            from_item = KeywordMatcher.from_item
+            expression = Expression.compile(keyword)
+        except (ImportError, AttributeError):
+            log.debug("Keyword selection pushdown is not supported")
+            return None
+        except Exception:
+            # pytest reports the invalid expression itself
+            return None
+        return lambda item: expression.evaluate(from_item(item))
+
+    def collect(self) -> Iterable[Union[pytest.Item, pytest.Collector]]:
+        if self.config.getoption("--rst-follow-includes"):
+            # Files are collected once, either on their own or as
+            # included by the first file including them
+            collected = self.config.stash[COLLECTED_FILES_KEY]
+            path = self.path.resolve()
+            if path in collected:
+                return
+            collected.add(path)
+
+        shared = self.config.getoption("--rst-shared-namespace")
+        interactive = self.config.stash[DOCTEST_FLAGS_KEY] is not None
+        parallel = self.parallel_by_default()
+        profiler = self.config.stash.get(COLLECTION_PROFILER_KEY, None)
+        timer: PhaseTimer = NULL_TIMER
+        if profiler is not None:
+            timer = profiler.timer(self.nodeid)
+
+        # Blocks deselected by node ids or -k do not become items,
+        # blocks sharing a namespace are left for pytest to deselect
+        names: Optional[Set[str]] = None
+        keywords: Optional[Callable[[pytest.Item], bool]] = None
+        if self.config.getoption("--rst-select-pushdown"):
+            names = self.selected_names()
+            keywords = self.keyword_matcher()
+
+        for compiled in self.compile_blocks(timer):
+            code_block = compiled.block
+            item_name = (
+                f"{compiled.name}"
+                f"[{code_block.start_line}:{code_block.end_line}]"
+            )
+
+            params = dict(code_block.params)
+            session = params.get("session")
+            if session is None and interactive and is_doctest_block(code_block):
+                session = DOCTEST_SESSION
+            if session is None and shared:
+                session = ""
+
+            if (
+                session is None
+                and names is not None
+                and compiled.name not in names
+                and item_name not in names
+            ):
+                continue
+
+            code: Optional[CodeType] = None
+            if isinstance(compiled, CompiledBlock):
+                code = compiled.code
+
+            namespace: Callable[[], Dict[str, Any]] = new_namespace
+            if session is not None:
+                namespace = partial(self.get_namespace, session)
+
+            item: pytest.Item
+            if compiled.fixture_names:
+                with timer.phase("wrapper"):
+                    wrapper = _make_rst_test_func(
+                        code,
+                        compiled.fixture_names,
+                        namespace,
+                        self.event_loop.run,
+                    )
+                item = pytest.Function.from_parent(
+                    name=item_name,
+                    parent=self,
+                    callobj=wrapper,
+                )
+            else:
+                item = RSTTestItem.from_parent(
+                    name=item_name,
+                    parent=self,
+                    namespace=namespace,
+                    parallel=parallel or "parallel" in params,
+                )
+
+            group = self.xdist_group(session)
+            if group is not None:
+                item.add_marker(pytest.mark.xdist_group(name=group))
+
+            item.stash[RST_BLOCK_KEY] = compiled
+            if code is not None:
+                item.stash[RST_IMPORTS_KEY] = extract_imports(code)
+            if session is not None:
+                item.stash[SHARED_NAMESPACE_KEY] = session
+
+            if session is None and keywords is not None and not keywords(item):
+                continue
+
+            if self.lazy_source is not None:
+                self.lazy_items.append(item)
+            yield item
+
+        yield from self.collect_includes()
+
+    def collect_includes(self) -> Iterator["RSTModule"]:
+        """
+        Collect included files not collected yet as modules of their own,
+        so blocks are reported with the path and lines of the included
+        file, whatever its extension is.
+        """
+        collected = self.config.stash[COLLECTED_FILES_KEY]
+        for path in dict.fromkeys(self.includes):
+            if path in collected:
+                continue
+            if not path.is_file():
+                log.warning("File %s included by %s not found", path, self.path)
+                continue
+            yield RSTModule.from_parent(parent=self.session, path=path)
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--rst-prefix",
+        default="test_",
+        help="RST code-block name prefix",
+    )
+    parser.addoption(
+        "--rst-cache-clear",
+        action="store_true",
+        default=False,
+        help="Remove the RST collection cache before the session starts",
+    )
+    parser.addoption(
+        "--rst-collect-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Parse and compile RST files in a pool of N processes",
+    )
+    parser.addoption(
+        "--rst-shared-namespace",
+        action="store_true",
+        default=False,
+        help=(
+            "Run code blocks of a document in one shared namespace, "
+            "like blocks with the same :session: option"
+        ),
+    )
+    parser.addoption(
+        "--rst-changed-since",
+        default=None,
+        metavar="REF",
+        help=(
+            "Collect only RST files changed since the git REF, including "
+            "uncommitted and untracked files"
+        ),
+    )
+    parser.addoption(
+        "--rst-changed-lines",
+        action="store_true",
+        default=False,
+        help=(
+            "With --rst-changed-since, deselect code blocks whose lines "
+            "were not changed"
+        ),
+    )
+    parser.addoption(
+        "--rst-affected-by",
+        action="append",
+        default=[],
+        metavar="PATHS",
+        help=(
+            "Select only code blocks importing modules from the given "
+            "comma separated python files, may be repeated"
+        ),
+    )
+    parser.addoption(
+        "--rst-isolate",
+        action="store_true",
+        default=False,
+        help=(
+            "Execute code blocks without fixtures in a pool of "
+            "worker processes"
+        ),
+    )
+    parser.addoption(
+        "--rst-isolate-backend",
+        choices=IsolatedPool.BACKENDS,
+        default="spawn",
+        help=(
+            "How --rst-isolate starts worker processes, 'forkserver' forks "
+            "a fresh worker per block with rst_preload modules imported"
+        ),
+    )
+    parser.addoption(
+        "--rst-isolate-workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of worker processes for --rst-isolate",
+    )
+    parser.addoption(
+        "--rst-isolate-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Fail isolated code blocks running longer than SECONDS",
+    )
+    parser.addoption(
+        "--rst-isolate-max-rss",
+        type=int,
+        default=None,
+        metavar="MB",
+        help="Fail isolated code blocks growing worker RSS over MB",
+    )
+    parser.addoption(
+        "--rst-isolate-max-blocks",
+        type=int,
+        default=100,
+        metavar="N",
+        help="Replace isolated worker process after N blocks (0 - never)",
+    )
+    parser.addini(
+        "rst_preload",
+        default="",
+        help=(
+            "Comma separated modules imported by --rst-isolate workers "
+            "before executing code blocks"
+        ),
+    )
+    parser.addoption(
+        "--rst-event-loop-scope",
+        choices=("session", "module"),
+        default="session",
+        help=(
+            "Share the event loop running code blocks with top-level "
+            "await across the session or a single RST file"
+        ),
+    )
+    parser.addoption(
+        "--rst-async-concurrent",
+        action="store_true",
+        default=False,
+        help=(
+            "Run asynchronous code blocks of the same RST file "
+            "concurrently on the shared event loop"
+        ),
+    )
+    parser.addoption(
+        "--rst-parallel-threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help=(
+            "Run code blocks marked with :parallel: or matching rst_parallel "
+            "in N threads (default: 0, run them one by one)"
+        ),
+    )
+    parser.addini(
+        "rst_parallel",
+        type="args",
+        default=[],
+        help=(
+            "Glob patterns of RST files whose code blocks without fixtures "
+            "may run concurrently in threads"
+        ),
+    )
+    parser.addoption(
+        "--rst-xdist-group",
+        choices=("none", "file"),
+        default="none",
+        help=(
+            "Put all code blocks of an RST file into one pytest-xdist "
+            "group, effective with --dist loadgroup"
+        ),
+    )
+    parser.addoption(
+        "--rst-shard",
+        default=None,
+        metavar="INDEX/COUNT",
+        help=(
+            "Run only the INDEX-th of COUNT shards of RST code blocks, "
+            "balanced by durations of previous runs"
+        ),
+    )
+    parser.addoption(
+        "--rst-doctest",
+        action="store_true",
+        default=False,
+        help=(
+            "Run interactive ``>>>`` examples of pycon code blocks and "
+            "plain doctest blocks, compared using doctest_optionflags"
+        ),
+    )
+    parser.addoption(
+        "--rst-follow-includes",
+        action="store_true",
+        default=False,
+        help=(
+            "Collect code blocks of files included by RST include "
+            "directives, once per session"
+        ),
+    )
+    parser.addoption(
+        "--rst-mmap",
+        action="store_true",
+        default=False,
+        help=(
+            "Memory map RST files and decode only the lines of code "
+            "blocks while parsing"
+        ),
+    )
+    parser.addoption(
+        "--rst-lazy-compile",
+        action="store_true",
+        default=False,
+        help=(
+            "Compile code blocks missing in the collection cache when "
+            "they are about to run instead of during collection"
+        ),
+    )
+    parser.addoption(
+        "--rst-select-pushdown",
+        action="store_true",
+        default=False,
+        help=(
+            "Do not create items for code blocks not selected by node ids "
+            "or -k at all"
+        ),
+    )
+    parser.addoption(
+        "--rst-durations",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Show N slowest RST code blocks (N=0 for all)",
+    )
+    parser.addoption(
+        "--rst-profile-collect",
+        default=None,
+        metavar="PATH",
+        help="Write RST collection phase timings as JSON to PATH",
+    )
+    parser.addoption(
+        "--rst-profile-collect-cprofile",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Also dump a cProfile profile of the collection to PATH, "
+            "requires --rst-profile-collect"
+        ),
+    )
+    parser.addoption(
+        "--rst-trace-memory",
+        action="store_true",
+        default=False,
+        help="Record peak memory allocated by each RST code block",
+    )
+
+
+def doctest_optionflags(config: pytest.Config) -> Optional[int]:
+    """Option flags of interactive examples, ``None`` without --rst-doctest"""
+    if not config.getoption("--rst-doctest"):
+        return None
+    try:
+        from _pytest.doctest import get_optionflags
+
+        return get_optionflags(config)
+    except (ImportError, ValueError):
+        # No doctest plugin, or it is disabled along with its ini options
+        return 0
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    doctest_flags = config.stash[DOCTEST_FLAGS_KEY] = doctest_optionflags(
+        config,
+    )
+    cache: Optional[CollectionCache] = None
+    pytest_cache: Optional[pytest.Cache] = getattr(config, "cache", None)
+    if pytest_cache is not None:
+        cache = CollectionCache(
+            pytest_cache,
+            config.getoption("--rst-prefix"),
+            doctest_flags,
+        )
+        # Workers must not drop entries prepared by the xdist controller
+        if config.getoption("--rst-cache-clear") and not is_xdist_worker(
+            config,
+        ):
+            cache.clear()
+    config.stash[COLLECTION_CACHE_KEY] = cache
+    config.stash[COLLECTED_FILES_KEY] = set()
+    config.stash[COLLECTION_STATS_KEY] = CollectionStats()
+    config.stash[BLOCK_MEASUREMENTS_KEY] = []
+    config.stash[SESSION_DURATIONS_KEY] = {}
+    config.pluginmanager.register(
+        DurationRecorder(config.stash[SESSION_DURATIONS_KEY]),
+        "rst-duration-recorder",
+    )
+
+    shard = config.getoption("--rst-shard")
+    config.stash[SHARDING_KEY] = (
+        Sharding(
+            *Sharding.parse(shard),
+            durations=(
+                pytest_cache.get(DURATIONS_KEY, {})
+                if pytest_cache is not None
+                else {}
+            ),
+        )
+        if shard
+        else None
+    )
+
+    ref = config.getoption("--rst-changed-since")
+    config.stash[GIT_CHANGES_KEY] = (
+        GitChanges(config.rootpath, ref) if ref else None
+    )
+
+    report_path = config.getoption("--rst-profile-collect")
+    config.stash[COLLECTION_PROFILER_KEY] = (
+        CollectionProfiler(
+            report_path,
+            config.getoption("--rst-profile-collect-cprofile"),
+        )
+        if report_path
+        else None
+    )
+
+    workers = config.getoption("--rst-collect-workers")
+    config.stash[PARALLEL_COMPILER_KEY] = (
+        ParallelCompiler(
+            workers,
+            config.getoption("--rst-prefix"),
+            doctest_flags,
+        )
+        if workers > 0 and not is_xdist_worker(config)
+        else None
+    )
+
+    pool: Optional[IsolatedPool] = None
+    if config.getoption("--rst-isolate"):
+        max_rss = config.getoption("--rst-isolate-max-rss")
+        backend = config.getoption("--rst-isolate-backend")
+        import multiprocessing
+
+        if backend not in multiprocessing.get_all_start_methods():
+            raise pytest.UsageError(
+                f"--rst-isolate-backend {backend} is not supported "
+                f"on this platform",
+            )
+        pool = IsolatedPool(
+            size=max(config.getoption("--rst-isolate-workers"), 1),
+            timeout=config.getoption("--rst-isolate-timeout"),
+            max_rss=max_rss * 1024 * 1024 if max_rss else None,
+            max_blocks=config.getoption("--rst-isolate-max-blocks"),
+            backend=backend,
+            preload=filter(
+                None,
+                re.split(r"[,\s]+", config.getini("rst_preload")),
+            ),
+        )
+    config.stash[ISOLATED_POOL_KEY] = pool
+    config.stash[EVENT_LOOP_KEY] = BlockEventLoop()
+
+    threads = config.getoption("--rst-parallel-threads")
+    config.stash[THREAD_POOL_KEY] = (
+        BlockThreadPool(threads) if threads > 0 else None
+    )
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    event_loop = config.stash.get(EVENT_LOOP_KEY, None)
+    if event_loop is not None:
+        event_loop.close()
+    pool = config.stash.get(ISOLATED_POOL_KEY, None)
+    if pool is not None:
+        pool.close()
+    thread_pool = config.stash.get(THREAD_POOL_KEY, None)
+    if thread_pool is not None:
+        thread_pool.close()
+
+
+def is_xdist_worker(config: pytest.Config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+def is_xdist_controller(config: pytest.Config) -> bool:
+    return config.pluginmanager.hasplugin("dsession")
+
+
+def warm_collection_cache(config: pytest.Config) -> None:
+    """
+    Compile all RST files into the collection cache before pytest-xdist
+    starts workers, so every worker loads blocks instead of compiling.
+    """
+    cache = config.stash[COLLECTION_CACHE_KEY]
+    if cache is None:
+        return
+
+    prefix = config.getoption("--rst-prefix")
+    doctest_flags = config.stash[DOCTEST_FLAGS_KEY]
+    compiler = config.stash[PARALLEL_COMPILER_KEY]
+    pending: List[SourceFile] = []
+    for path in discover_rst_files(config):
+        if not has_candidate_blocks(path, prefix, doctest_flags is not None):
+            continue
+        source = SourceFile.read(path)
+        if cache.load(path, source.mtime_ns, source.digest) is not None:
+            continue
+        pending.append(source)
+        if compiler is not None:
+            compiler.submit(source)
+
+    for source in pending:
+        blocks = compiler.result(source) if compiler is not None else None
+        if blocks is None:
+            previous = cache.load_previous(source.path)
+            blocks = source.compile(
+                prefix,
+                previous=previous,
+                doctest_flags=doctest_flags,
+            )
+        cache.store(source.path, source.mtime_ns, source.digest, blocks)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionstart(session: pytest.Session) -> None:
+    if is_xdist_controller(session.config):
+        warm_collection_cache(session.config)
+
+
+def schedule_parallel_compilation(config: pytest.Config) -> None:
+    compiler = config.stash[PARALLEL_COMPILER_KEY]
+    if compiler is None:
+        return
+
+    prefix = config.getoption("--rst-prefix")
+    interactive = config.stash[DOCTEST_FLAGS_KEY] is not None
+    cache = config.stash[COLLECTION_CACHE_KEY]
+    for path in discover_rst_files(config):
+        if not has_candidate_blocks(path, prefix, interactive):
+            continue
+        source = SourceFile.read(path)
+        if cache is not None:
+            if cache.load(path, source.mtime_ns, source.digest) is not None:
+                continue
+        compiler.submit(source)
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_collection(session: pytest.Session) -> Generator[None, Any, Any]:
+    profiler = session.config.stash[COLLECTION_PROFILER_KEY]
+    if profiler is not None:
+        profiler.start()
+
+    try:
+        schedule_parallel_compilation(session.config)
+        return (yield)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write()
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    compiler = session.config.stash[PARALLEL_COMPILER_KEY]
+    if compiler is not None:
+        compiler.shutdown()
+
+
+def pytest_report_collectionfinish(config: pytest.Config) -> List[str]:
+    stats = config.stash[COLLECTION_STATS_KEY]
+    lines = []
+    if stats.files_skipped:
+        lines.append(
+            f"rst: skipped {stats.files_skipped} of {stats.files_seen} "
+            f"files without candidate code blocks",
+        )
+    changes = config.stash[GIT_CHANGES_KEY]
+    if changes is not None and stats.files_unchanged:
+        lines.append(
+            f"rst: skipped {stats.files_unchanged} files unchanged "
+            f"since {changes.ref}",
+        )
+    return lines
+
+
+def _format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+def pytest_terminal_summary(
+    terminalreporter: pytest.TerminalReporter,
+    config: pytest.Config,
+) -> None:
+    sharding = config.stash[SHARDING_KEY]
+    if sharding is not None:
+        durations = config.stash[SESSION_DURATIONS_KEY]
+        actual = sum(
+            duration
+            for nodeid, duration in durations.items()
+            if nodeid in sharding.selected
+        )
+        terminalreporter.write_sep(
+            "=",
+            f"rst shard {sharding.index}/{sharding.count}",
+        )
+        terminalreporter.write_line(
+            f"{len(sharding.selected)} blocks, predicted "
+            f"{sharding.format(sharding.predicted[sharding.index - 1])}, "
+            f"actual {actual:.2f}s",
+        )
+        terminalreporter.write_line(
+            "predicted shards: "
+            + ", ".join(sharding.format(p) for p in sharding.predicted),
+        )
+
+    limit = config.getoption("--rst-durations")
+    if limit is None:
+        return
+
+    measured = config.stash[BLOCK_MEASUREMENTS_KEY]
+    measurements = sorted(
+        measured,
+        key=lambda m: m.usage.wall_time,
+        reverse=True,
+    )
+    if limit > 0:
+        measurements = measurements[:limit]
+        terminalreporter.write_sep("=", f"slowest {limit} rst blocks")
+    else:
+        terminalreporter.write_sep("=", "slowest rst blocks")
+
+    by_path: Dict[str, List[BlockMeasurement]] = {}
+    for measurement in measurements:
+        by_path.setdefault(measurement.path, []).append(measurement)
+
+    for path, items in by_path.items():
+        terminalreporter.write_line(path)
+        for m in items:
+            line = (
+                f"    {m.start_line}-{m.end_line} {m.name}: "
+                f"wall {m.usage.wall_time:.3f}s "
+                f"cpu {m.usage.cpu_time:.3f}s"
+            )
+            if m.usage.peak_memory is not None:
+                line += f" peak {_format_size(m.usage.peak_memory)}"
+            terminalreporter.write_line(line)
+
+
+def update_imports_index(session: pytest.Session) -> None:
+    """
+    Persist the block to imported modules index into the pytest cache,
+    so tools may find blocks affected by a change without collecting.
+    """
+    cache: Optional[pytest.Cache] = getattr(session.config, "cache", None)
+    collected: Dict[str, List[str]] = {}
+    for item in session.items:
+        imports = item.stash.get(RST_IMPORTS_KEY, None)
+        if imports is not None:
+            collected[item.nodeid] = list(imports)
+    if cache is None or not collected:
+        return
+
+    rootpath = session.config.rootpath
+    index: Dict[str, List[str]] = {
+        nodeid: imports
+        for nodeid, imports in cache.get(IMPORTS_INDEX_KEY, {}).items()
+        if (rootpath / nodeid.split("::", 1)[0]).exists()
+    }
+    index.update(collected)
+    cache.set(IMPORTS_INDEX_KEY, index)
+
+
+def update_durations(config: pytest.Config) -> None:
+    """Persist durations of executed blocks for ``--rst-shard``"""
+    cache: Optional[pytest.Cache] = getattr(config, "cache", None)
+    durations = config.stash[SESSION_DURATIONS_KEY]
+    if cache is None or not durations or is_xdist_worker(config):
+        return
+
+    rootpath = config.rootpath
+    stored: Dict[str, float] = {
+        nodeid: duration
+        for nodeid, duration in cache.get(DURATIONS_KEY, {}).items()
+        if (rootpath / nodeid.split("::", 1)[0]).exists()
+    }
+    stored.update(durations)
+    cache.set(DURATIONS_KEY, stored)
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    update_imports_index(session)
+    update_durations(session.config)
+
+    compiler = session.config.stash.get(PARALLEL_COMPILER_KEY, None)
+    if compiler is not None:
+        compiler.shutdown()
+
+    # The pytest-xdist controller evicts entries when workers are done
+    cache = session.config.stash.get(COLLECTION_CACHE_KEY, None)
+    if cache is not None and not is_xdist_worker(session.config):
+        cache.evict_stale()
+
+
+def deselect_items(
+    config: pytest.Config,
+    items: List[pytest.Item],
+    selected: Callable[[pytest.Item], bool],
+) -> None:
+    """
+    Deselect RST items for which ``selected`` is false. Blocks sharing
+    a namespace are kept or deselected together, since they depend on
+    each other.
+    """
+    keep_sessions: Set[Tuple[str, str]] = set()
+    for item in items:
+        session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+        if session is not None and selected(item):
+            keep_sessions.add((item.nodeid.split("::", 1)[0], session))
+
+    remaining: List[pytest.Item] = []
+    deselected: List[pytest.Item] = []
+    for item in items:
+        if RST_BLOCK_KEY not in item.stash:
+            remaining.append(item)
+            continue
+
+        session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+        if session is not None:
+            keep = (item.nodeid.split("::", 1)[0], session) in keep_sessions
+        else:
+            keep = selected(item)
+        (remaining if keep else deselected).append(item)
+
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = remaining
+
+
+def _block_changed(changes: GitChanges, item: pytest.Item) -> bool:
+    block = item.stash[RST_BLOCK_KEY].block
+    # Diff hunks are 1-based, the directive and its options are included
+    first = block.directive_line + 1
+    last = max(block.start_line + block.line_count, first)
+    return changes.intersects(item.path, first, last)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(
+    config: pytest.Config,
+    items: List[pytest.Item],
+) -> None:
+    changes = config.stash[GIT_CHANGES_KEY]
+    if changes is not None and config.getoption("--rst-changed-lines"):
+        deselect_items(config, items, partial(_block_changed, changes))
+
+    affected_by = config.getoption("--rst-affected-by")
+    if affected_by:
+        root = config.invocation_params.dir
+        selector = AffectedBy(
+            (
+                root / path.strip()
+                for value in affected_by
+                for path in value.split(",")
+                if path.strip()
+            ),
+            [config.rootpath, config.rootpath / "src"]
+            + [Path(entry) for entry in sys.path if entry],
+        )
+        deselect_items(config, items, selector.is_affected)
+
+    sharding = config.stash[SHARDING_KEY]
+    if sharding is not None:
+        sharding.split(items)
+        deselect_items(
+            config,
+            items,
+            lambda item: item.nodeid in sharding.selected,
+        )
+
+    # Blocks sharing a namespace depend on each other, so they must run
+    # in document order even when other plugins have reordered items.
+    slots: Dict[Tuple[str, str], List[int]] = {}
+    for index, item in enumerate(items):
+        session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+        if session is not None and isinstance(item.parent, RSTModule):
+            slots.setdefault((item.parent.nodeid, session), []).append(index)
+
+    for indexes in slots.values():
+        ordered = sorted(
+            (items[index] for index in indexes),
+            key=lambda item: item.stash[RST_BLOCK_KEY].block.start_line,
+        )
+        for index, item in zip(indexes, ordered):
+            items[index] = item
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item: pytest.Item) -> Generator[None, None, None]:
+    compiled = item.stash.get(RST_BLOCK_KEY, None)
+    if compiled is None:
+        return (yield)
+
+    trace_memory = item.config.getoption("--rst-trace-memory")
+    usage = ResourceUsage()
+    try:
+        with measure_usage(trace_memory) as usage:
+            return (yield)
+    finally:
+        item.user_properties.append(("rst_wall_time", usage.wall_time))
+        item.user_properties.append(("rst_cpu_time", usage.cpu_time))
+        if usage.peak_memory is not None:
+            item.user_properties.append(
+                ("rst_peak_memory", usage.peak_memory),
+            )
+        item.config.stash[BLOCK_MEASUREMENTS_KEY].append(
+            BlockMeasurement(
+                path=item.nodeid.split("::", 1)[0],
+                name=compiled.name,
+                start_line=compiled.block.start_line,
+                end_line=compiled.block.end_line,
+                usage=usage,
+            ),
+        )
+
+
+def pytest_runtest_setup(item: pytest.Item) -> None:
+    if RST_BLOCK_KEY not in item.stash:
+        return
+
+    session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+    if session is not None and isinstance(item.parent, RSTModule):
+        failed = item.parent.failed_sessions.get(session)
+        if failed is not None:
+            pytest.skip(
+                f"previous block {failed} in shared namespace "
+                f"{session!r} failed",
+            )
+
+    compiled_block(item)
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_makereport(
+    item: pytest.Item,
+    call: pytest.CallInfo,
+) -> Generator[None, pytest.TestReport, pytest.TestReport]:
+    report = yield
+    session = item.stash.get(SHARED_NAMESPACE_KEY, None)
+    if (
+        session is not None
+        and report.failed
+        and isinstance(item.parent, RSTModule)
+    ):
+        item.parent.failed_sessions.setdefault(session, item.name)
+    return report
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collect_file(
+    file_path: Path,
+    parent: pytest.Collector,
+) -> Optional[RSTModule]:
+    if file_path.suffix != ".rst":
+        return None
+
+    stats = parent.config.stash[COLLECTION_STATS_KEY]
+    stats.files_seen += 1
+
+    changes = parent.config.stash[GIT_CHANGES_KEY]
+    if changes is not None and not changes.is_changed(file_path):
+        stats.files_unchanged += 1
+        return None
+
+    if not has_candidate_blocks(
+        file_path,
+        parent.config.getoption("--rst-prefix"),
+        parent.config.stash[DOCTEST_FLAGS_KEY] is not None,
+        parent.config.getoption("--rst-follow-includes"),
+    ):
+        stats.files_skipped += 1
+        return None
+
     return RSTModule.from_parent(parent=parent, path=file_path)
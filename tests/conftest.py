@@ -1 +1,16 @@
+from textwrap import dedent, indent
+
+
 pytest_plugins = ["pytester"]
+
+
+def rst_block(name: str, code: str, **options: str) -> str:
+    """``code-block`` directive with the name, options and code"""
+    head = [".. code-block:: python", f"    :name: {name}"]
+    head += [f"    :{key}: {value}".rstrip() for key, value in options.items()]
+    body = indent(dedent(code).strip("\n"), "    ")
+    return "\n".join(head) + f"\n\n{body}\n\n"
+
+
+def rst_document(*blocks: str) -> str:
+    return "".join(blocks) + "End.\n"
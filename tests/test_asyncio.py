@@ -0,0 +1,259 @@
+from textwrap import dedent
+
+from pytest_rst import BlockEventLoop, compile_source, is_async_code
+
+
+ASYNC_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_await
+
+        import asyncio
+
+        await asyncio.sleep(0)
+        assert await asyncio.sleep(0, result=42) == 42
+
+    .. code-block:: python
+        :name: test_await_fails
+
+        import asyncio
+
+        await asyncio.sleep(0)
+        assert False
+
+    End.
+""")
+
+
+def test_compile_top_level_await():
+    code = compile_source("import asyncio\nawait asyncio.sleep(0)\n", "x", 0)
+    assert is_async_code(code)
+    assert not is_async_code(compile_source("x = 1\n", "x", 0))
+
+    namespace: dict = {}
+    event_loop = BlockEventLoop()
+    event_loop.run(code, namespace)
+    loop = event_loop.get()
+    event_loop.run(code, namespace)
+    assert event_loop.get() is loop
+
+    event_loop.close()
+    assert loop.is_closed()
+    assert event_loop.get() is not loop
+    event_loop.close()
+
+
+def test_top_level_await(pytester):
+    pytester.makefile(".rst", test_doc=ASYNC_DOC)
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["test_doc.rst:15: AssertionError"])
+
+
+def test_top_level_await_isolated(pytester):
+    pytester.makefile(".rst", test_doc=ASYNC_DOC)
+    result = pytester.runpytest("--rst-isolate")
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(['*File "*test_doc.rst", line 15, in <module>'])
+
+
+def test_top_level_await_with_fixtures(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_fixture
+                :fixtures: tmp_path
+
+                import asyncio
+
+                await asyncio.sleep(0)
+                assert tmp_path.is_dir()
+
+            End.
+        """),
+    )
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+
+
+LOOP_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_loop
+
+        import asyncio
+        import sys
+
+        await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+        assert getattr(sys, "rst_loop", loop) is loop
+        sys.rst_loop = loop
+
+    End.
+""")
+
+
+def test_event_loop_scope(pytester):
+    pytester.makefile(".rst", test_first=LOOP_DOC, test_second=LOOP_DOC)
+    pytester.makeconftest("""
+        import sys
+
+        def pytest_configure():
+            sys.__dict__.pop("rst_loop", None)
+    """)
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2)
+
+    result = pytester.runpytest("--rst-event-loop-scope=module")
+    result.assert_outcomes(passed=1, failed=1)
+
+
+CONCURRENT_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_waiter
+
+        import asyncio
+        import sys
+
+        sys.rst_future = asyncio.get_running_loop().create_future()
+        assert await asyncio.wait_for(sys.rst_future, 1) == 1
+
+    .. code-block:: python
+        :name: test_failing
+
+        import asyncio
+
+        await asyncio.sleep(0)
+        raise ValueError("concurrent")
+
+    .. code-block:: python
+        :name: test_setter
+
+        import asyncio
+        import sys
+
+        await asyncio.sleep(0.1)
+        sys.rst_future.set_result(1)
+
+    End.
+""")
+
+
+def test_async_concurrent(pytester):
+    pytester.makefile(".rst", test_doc=CONCURRENT_DOC)
+
+    result = pytester.runpytest("-v", "--rst-async-concurrent")
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines(["*test_failing*FAILED*"])
+    result.stdout.fnmatch_lines(["E   ValueError: concurrent"])
+
+    result = pytester.runpytest()
+    result.assert_outcomes(failed=3)
+
+
+OUTPUT_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_first
+
+        import asyncio
+        import sys
+
+        print("first output")
+        await asyncio.sleep(0.1)
+        print("first error", file=sys.stderr)
+        assert False
+
+    .. code-block:: python
+        :name: test_second
+
+        import asyncio
+
+        print("second output")
+        await asyncio.sleep(0)
+        raise ValueError("second")
+
+    .. code-block:: python
+        :name: test_third
+
+        import asyncio
+
+        await asyncio.sleep(0)
+        open("third.txt", "w").close()
+
+    End.
+""")
+
+
+def test_async_concurrent_output(pytester):
+    pytester.makefile(".rst", test_doc=OUTPUT_DOC)
+
+    result = pytester.runpytest("--rst-async-concurrent")
+    result.assert_outcomes(passed=1, failed=2)
+    result.stdout.fnmatch_lines(
+        [
+            "*- Captured stdout call -*",
+            "first output",
+            "*- Captured stderr call -*",
+            "first error",
+            "*- Captured stdout call -*",
+            "second output",
+        ],
+    )
+    assert result.stdout.lines.count("first output") == 1
+    assert result.stdout.lines.count("second output") == 1
+
+
+def test_async_concurrent_maxfail(pytester):
+    pytester.makefile(".rst", test_doc=OUTPUT_DOC)
+
+    result = pytester.runpytest("--rst-async-concurrent", "-x")
+    result.assert_outcomes(failed=1)
+    assert not pytester.path.joinpath("third.txt").exists()
+
+
+SKIP_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_first
+
+        import asyncio
+
+        print("first output")
+        await asyncio.sleep(0.1)
+
+    .. code-block:: python
+        :name: test_second
+
+        import asyncio
+
+        import pytest
+
+        await asyncio.sleep(0)
+        pytest.skip("second skipped")
+
+    .. code-block:: python
+        :name: test_third
+
+        import asyncio
+
+        await asyncio.sleep(0)
+        with open("third.txt", "a") as f:
+            f.write("ran\\n")
+
+    End.
+""")
+
+
+def test_async_concurrent_skip(pytester):
+    pytester.makefile(".rst", test_doc=SKIP_DOC)
+
+    result = pytester.runpytest("--rst-async-concurrent", "-v", "-rsP")
+    result.assert_outcomes(passed=2, skipped=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_first* PASSED*",
+            "*test_second* SKIPPED (second skipped)*",
+            "*test_third* PASSED*",
+        ],
+    )
+    result.stdout.fnmatch_lines(["first output"])
+    assert pytester.path.joinpath("third.txt").read_text() == "ran\n"
@@ -0,0 +1,226 @@
+import traceback
+from io import StringIO
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import CodeBlock, CollectionCache, CompiledBlock
+
+
+SAMPLE = dedent("""\
+    Example:
+
+    .. code-block:: python
+        :name: test_cached
+
+        assert 1 + 1 == 2
+
+    End.
+""")
+
+
+def _cache_entries(pytester) -> list:
+    directory = pytester.path / ".pytest_cache" / "d" / "pytest-rst"
+    if not directory.exists():
+        return []
+    return sorted(directory.iterdir())
+
+
+def _compiled(name: str = "test_x") -> CompiledBlock:
+    block = CodeBlock(
+        start_line=3,
+        params=(("name", name),),
+        syntax="python",
+        lines=("x = 1",),
+    )
+    return CompiledBlock(
+        name=name,
+        block=block,
+        fixture_names=("tmp_path",),
+        code=compile("x = 1", "doc.rst", "exec"),
+    )
+
+
+def test_cache_roundtrip(pytester):
+    cache = CollectionCache(pytester.parseconfigure().cache, "test_")
+    path = Path("doc.rst")
+    blocks = [_compiled()]
+
+    cache.store(path, 1, "digest", blocks)
+    assert cache.load(path, 1, "digest") == blocks
+
+
+def test_cache_key_mismatch(pytester):
+    config = pytester.parseconfigure()
+    cache = CollectionCache(config.cache, "test_")
+    path = Path("doc.rst")
+    cache.store(path, 1, "digest", [_compiled()])
+
+    assert cache.load(path, 2, "digest") is None
+    assert cache.load(path, 1, "other") is None
+    assert cache.load(Path("other.rst"), 1, "digest") is None
+    assert CollectionCache(config.cache, "doc_").load(
+        path,
+        1,
+        "digest",
+    ) is None
+
+
+def test_cache_corrupted_entry(pytester):
+    cache = CollectionCache(pytester.parseconfigure().cache, "test_")
+    path = Path("doc.rst")
+    cache.store(path, 1, "digest", [_compiled()])
+    (cache.directory / cache.entry_name(path)).write_bytes(b"garbage")
+    assert cache.load(path, 1, "digest") is None
+
+
+def test_cache_written_and_reused(pytester):
+    pytester.makefile(".rst", test_doc=SAMPLE)
+
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines(["*test_cached*PASSED*"])
+    assert len(_cache_entries(pytester)) == 1
+
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines(["*test_cached*PASSED*"])
+    assert len(_cache_entries(pytester)) == 1
+
+
+def test_cache_invalidated_on_change(pytester):
+    path = pytester.makefile(".rst", test_doc=SAMPLE)
+    pytester.runpytest()
+
+    path.write_text(SAMPLE.replace("1 + 1 == 2", "1 + 1 == 3"))
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines(["*test_cached*FAILED*"])
+
+
+def test_cache_stale_entries_evicted(pytester):
+    path = pytester.makefile(".rst", test_doc=SAMPLE)
+    pytester.makefile(".rst", test_other=SAMPLE)
+    pytester.runpytest()
+    assert len(_cache_entries(pytester)) == 2
+
+    path.unlink()
+    pytester.runpytest()
+    assert len(_cache_entries(pytester)) == 1
+
+
+def test_cache_keeps_temporary_entries(pytester):
+    pytester.makefile(".rst", test_doc=SAMPLE)
+    pytester.runpytest()
+    # Written by another process, not in the index yet
+    tmp = _cache_entries(pytester)[0].with_suffix(".1234.tmp")
+    tmp.write_bytes(b"")
+    pytester.runpytest()
+    assert tmp.exists()
+
+
+def test_cache_untouched_without_rst_files(pytester):
+    pytester.makepyfile(test_plain="def test_plain():\n    pass\n")
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+    cache = pytester.path / ".pytest_cache"
+    assert not (cache / "d" / "pytest-rst").exists()
+    assert not (cache / "v" / "pytest-rst").exists()
+
+
+def test_cache_clear_option(pytester):
+    pytester.makefile(".rst", test_doc=SAMPLE)
+    pytester.runpytest()
+    entries = _cache_entries(pytester)
+    assert len(entries) == 1
+
+    entries[0].write_bytes(b"garbage")
+    result = pytester.runpytest("-v", "--rst-cache-clear")
+    result.stdout.fnmatch_lines(["*test_cached*PASSED*"])
+    assert len(_cache_entries(pytester)) == 1
+    assert _cache_entries(pytester)[0].read_bytes() != b"garbage"
+
+
+def test_cache_disabled_without_cacheprovider(pytester):
+    pytester.makefile(".rst", test_doc=SAMPLE)
+    result = pytester.runpytest("-v", "-p", "no:cacheprovider")
+    result.stdout.fnmatch_lines(["*test_cached*PASSED*"])
+
+
+INCREMENTAL = dedent("""\
+    .. code-block:: python
+        :name: test_unchanged
+
+        x = 1
+        assert x == 2
+
+    .. code-block:: python
+        :name: test_changed
+
+        assert True
+
+    End.
+""")
+
+
+def test_compile_reuses_unchanged_blocks(monkeypatch):
+    import pytest_rst
+
+    previous = pytest_rst.compile_code_blocks(
+        StringIO(INCREMENTAL),
+        "doc.rst",
+        "test_",
+    )
+
+    compiled_sources = []
+    original = pytest_rst.compile_source
+
+    def compile_source(source, filename, offset):
+        compiled_sources.append(source)
+        return original(source, filename, offset)
+
+    monkeypatch.setattr(pytest_rst, "compile_source", compile_source)
+
+    changed = "Intro\n\n" + INCREMENTAL.replace("True", "not False")
+    blocks = pytest_rst.compile_code_blocks(
+        StringIO(changed),
+        "doc.rst",
+        "test_",
+        previous=previous,
+    )
+    assert compiled_sources == ["assert not False\n"]
+    assert blocks[0].code is not previous[0].code
+    assert blocks[0].block.start_line == previous[0].block.start_line + 2
+
+    with pytest.raises(AssertionError) as e:
+        exec(blocks[0].code, {})
+    tb = traceback.extract_tb(e.value.__traceback__)
+    assert tb[-1].lineno == blocks[0].block.start_line + 2
+
+
+def test_incremental_recollection(pytester):
+    path = pytester.makefile(".rst", test_doc=INCREMENTAL)
+    result = pytester.runpytest()
+    result.stdout.fnmatch_lines(["test_doc.rst:5: AssertionError"])
+
+    path.write_text("Intro\n\n" + INCREMENTAL)
+    result = pytester.runpytest()
+    result.stdout.fnmatch_lines(["test_doc.rst:7: AssertionError"])
+    result.assert_outcomes(passed=1, failed=1)
+
+
+DOCTEST_INCREMENTAL = dedent("""\
+    >>> 1 + 1
+    3
+
+    End.
+""")
+
+
+def test_incremental_doctest_line_numbers(pytester):
+    path = pytester.makefile(".rst", test_doc=DOCTEST_INCREMENTAL)
+    result = pytester.runpytest("--rst-doctest")
+    result.stdout.fnmatch_lines(["test_doc.rst:1: output mismatch"])
+
+    path.write_text("Intro\n\n" + DOCTEST_INCREMENTAL)
+    result = pytester.runpytest("--rst-doctest")
+    result.stdout.fnmatch_lines(["test_doc.rst:3: output mismatch"])
+    result.assert_outcomes(failed=1)
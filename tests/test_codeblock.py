@@ -0,0 +1,153 @@
+from io import StringIO
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import (
+    CodeBlock,
+    compile_code_blocks,
+    pack_blocks,
+    parse_code_blocks,
+    unpack_blocks,
+)
+
+
+def _block(lines=("x = 1", "", "assert x"), **kwargs) -> CodeBlock:
+    return CodeBlock(
+        start_line=kwargs.pop("start_line", 3),
+        params=kwargs.pop("params", (("name", "test_x"),)),
+        syntax=kwargs.pop("syntax", "python"),
+        lines=lines,
+        directive_line=kwargs.pop("directive_line", None),
+    )
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [(), ("",), ("x = 1",), ("x = 1", "", "assert x"), ("", "")],
+)
+def test_lines_roundtrip(lines):
+    block = _block(lines)
+    assert block.lines == lines
+    assert block.line_count == len(lines)
+    assert block.end_line == block.start_line + len(lines) + 1
+
+
+def test_source_joined():
+    block = _block()
+    assert block.source == "x = 1\n\nassert x"
+    restored = CodeBlock.from_source(
+        3,
+        block.params,
+        "python",
+        block.source,
+        3,
+    )
+    assert restored == block
+
+
+def test_equality_and_hash():
+    assert _block() == _block()
+    assert hash(_block()) == hash(_block())
+    assert _block() != _block(start_line=4)
+    assert _block() == _block(directive_line=1)
+    assert hash(_block()) == hash(_block(directive_line=1))
+    assert _block() != _block(lines=("x = 1",))
+    assert _block(lines=()) != _block(lines=("",))
+    assert _block() != object()
+
+
+def test_equality_with_tuple():
+    block = _block(lines=("pass",))
+    as_tuple = (3, (("name", "test_x"),), "python", ("pass",))
+    assert block == as_tuple
+    assert as_tuple == block
+    assert hash(block) == hash(as_tuple)
+    assert block in {as_tuple}
+    assert block != (3, (("name", "test_x"),), "python", ("fail",))
+    assert block._lines is None
+    assert block != tuple(block)[:3]
+
+
+def test_lines_split_once():
+    block = _block()
+    assert block.lines is block.lines
+    assert block._split_lines() == list(block.lines)
+
+
+def test_named_tuple_surface():
+    block = _block(lines=("pass",))
+    start_line, params, syntax, lines = block
+    assert (start_line, syntax, lines) == (3, "python", ("pass",))
+    assert params == (("name", "test_x"),)
+    assert len(block) == 4
+    assert block[0] == 3
+    assert block[-1] == ("pass",)
+    assert block[1:3] == (params, "python")
+    assert block._fields == ("start_line", "params", "syntax", "lines")
+    assert block._asdict() == {
+        "start_line": 3,
+        "params": params,
+        "syntax": "python",
+        "lines": ("pass",),
+    }
+
+
+def test_replace():
+    block = _block(directive_line=1)
+    moved = block._replace(start_line=5)
+    assert moved == _block(start_line=5, directive_line=1)
+    assert moved.directive_line == 1
+    assert block._replace(lines=("pass",)).source == "pass"
+    assert block._replace() == block
+    with pytest.raises(ValueError, match="source"):
+        block._replace(source="pass")
+
+
+def test_slots():
+    block = _block()
+    with pytest.raises(AttributeError):
+        block.extra = 1  # type: ignore[attr-defined]
+
+
+def test_param_names_interned():
+    document = dedent("""\
+        .. code-block:: python
+            :name: test_a
+
+            pass
+
+        .. code-block:: python
+            :name: test_b
+
+            pass
+
+        End.
+    """)
+    first, second = parse_code_blocks(StringIO(document))
+    assert first.params[0][0] is second.params[0][0]
+    assert first.syntax is second.syntax
+
+
+def test_repr():
+    assert repr(_block(lines=("pass",))) == (
+        "CodeBlock(start_line=3, params=(('name', 'test_x'),), "
+        "syntax='python', lines=('pass',), directive_line=3)"
+    )
+
+
+def test_pack_roundtrip():
+    document = dedent("""\
+        .. code-block:: python
+            :name: test_gap
+
+            x = 1
+
+
+            assert x
+
+        End.
+    """)
+    blocks = compile_code_blocks(StringIO(document), "doc.rst", "test_")
+    assert unpack_blocks(pack_blocks(blocks)) == blocks
+    assert blocks[0].block.lines == ("x = 1", "", "", "assert x")
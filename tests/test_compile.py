@@ -0,0 +1,87 @@
+import traceback
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import compile_source, shift_code_lines
+
+
+SOURCE = dedent("""\
+    x = 1
+
+    class Foo:
+        def bar(self):
+            return [i for i in range(3) if 1 / 0]
+
+    Foo().bar()
+""")
+
+
+def _error_lines(code) -> list:
+    with pytest.raises(ZeroDivisionError) as e:
+        exec(code, {})
+    return [
+        (frame.name, frame.lineno)
+        for frame in traceback.extract_tb(e.value.__traceback__)[1:]
+    ]
+
+
+@pytest.mark.parametrize("offset", [0, 1, 100, 50000])
+def test_compile_source_line_numbers(offset):
+    padded = compile("\n" * offset + SOURCE, "doc.rst", "exec")
+    code = compile_source(SOURCE, "doc.rst", offset)
+
+    assert _error_lines(code) == _error_lines(padded)
+    assert _error_lines(code)[0] == ("<module>", offset + 7)
+
+
+def test_shift_code_lines_nested():
+    code = shift_code_lines(compile(SOURCE, "doc.rst", "exec"), 10)
+    cls = next(c for c in code.co_consts if getattr(c, "co_name", "") == "Foo")
+    method = next(
+        c for c in cls.co_consts if getattr(c, "co_name", "") == "bar"
+    )
+    assert cls.co_firstlineno == 13
+    assert method.co_firstlineno == 14
+
+
+@pytest.mark.parametrize("offset", [0, 42])
+def test_compile_source_syntax_error_line(offset):
+    source = "x = 1\ndef foo(\n"
+    with pytest.raises(SyntaxError) as padded:
+        compile("\n" * offset + source, "doc.rst", "exec")
+    with pytest.raises(SyntaxError) as e:
+        compile_source(source, "doc.rst", offset)
+
+    assert e.value.lineno == padded.value.lineno
+    assert e.value.end_lineno == padded.value.end_lineno
+
+
+def test_compile_source_syntax_error_text(tmp_path):
+    # Python reads the text of the error from the file at the unshifted line
+    path = tmp_path / "doc.rst"
+    path.write_text("Title\n\n.. code-block:: python\n\n    x = 1\n    y = (\n")
+    with pytest.raises(SyntaxError) as e:
+        compile_source("x = 1\ny = (\n", str(path), 4)
+    assert e.value.lineno == 6
+    assert e.value.text == "y = (\n"
+
+
+def test_traceback_points_to_rst_line(pytester):
+    pytester.makefile(
+        ".rst",
+        test_tb=dedent("""\
+            Traceback:
+
+            .. code-block:: python
+                :name: test_traceback
+
+                x = 1
+                y = 2
+                assert x == y
+
+            End.
+        """),
+    )
+    result = pytester.runpytest()
+    result.stdout.fnmatch_lines(["*test_tb.rst:8: AssertionError"])
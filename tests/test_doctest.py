@@ -0,0 +1,216 @@
+import doctest
+import sys
+from io import StringIO
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import (
+    DocTestMismatch,
+    compile_doctest,
+    doctest_optionflags,
+    doctest_parser,
+    new_namespace,
+    output_checker,
+    parse_code_blocks,
+    parse_code_blocks_mapped,
+)
+
+
+DOCUMENT = dedent("""\
+    Interactive session:
+
+    .. code-block:: pycon
+
+        >>> value = 40
+        >>> value + 2
+        42
+
+    Plain doctest block, sharing the namespace:
+
+    >>> print(value)
+    40
+
+    Inside a literal block::
+
+        >>> for i in range(2):
+        ...     i
+        0
+        1
+
+    .. code-block:: python
+        :name: test_python
+
+        assert True
+
+    End.
+""")
+
+
+def test_parse_default_ignores_sessions():
+    blocks = list(parse_code_blocks(StringIO(DOCUMENT)))
+    assert [block.syntax for block in blocks] == ["python"]
+
+
+def test_parse_doctest():
+    blocks = list(parse_code_blocks(StringIO(DOCUMENT), interactive=True))
+    assert [(block.syntax, block.start_line) for block in blocks] == [
+        ("pycon", 4),
+        ("pycon", 10),
+        ("pycon", 15),
+        ("python", 23),
+    ]
+    assert blocks[1].lines == (">>> print(value)", "40")
+    assert blocks[2].lines[1] == "...     i"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        DOCUMENT,
+        DOCUMENT.replace("\n", "\r\n"),
+        ">>> 1\n1",
+        "Text\n   >>> 1\n   1\n  back\n>>> 2\n2\n",
+        "a >>> b\n>>>\n",
+    ],
+    ids=["document", "crlf", "eof", "dedent", "prose"],
+)
+def test_parse_mapped_doctest(text):
+    expected = list(
+        parse_code_blocks(StringIO(text, newline=None), interactive=True),
+    )
+    assert list(parse_code_blocks_mapped(text.encode(), interactive=True)) == (
+        expected
+    )
+
+
+EXAMPLES = dedent("""\
+    >>> x = [1, 2, 3]
+    >>> x
+    [1, ..., 3]
+    >>> def f():
+    ...     return None
+    >>> f()
+    >>> print("a    b")  # doctest: +NORMALIZE_WHITESPACE
+    a b
+    >>> 1 / 0
+    Traceback (most recent call last):
+        ...
+    ZeroDivisionError: division by zero
+    >>> # comment
+""")
+
+
+def test_compile_doctest():
+    code = compile_doctest(EXAMPLES, "doc.rst", 0, doctest.ELLIPSIS)
+    exec(code, new_namespace())
+
+
+def test_compile_doctest_mismatch():
+    code = compile_doctest(">>> 1 + 1\n3\n", "doc.rst", 9, 0)
+    with pytest.raises(DocTestMismatch) as e:
+        exec(code, new_namespace())
+    assert e.value.lineno == 10
+    assert "Expected:\n    3\nGot:\n    2\n" in e.value.message
+
+
+def test_compile_doctest_unexpected_exception():
+    source = ">>> x = 1\n>>> raise KeyError(x)\n"
+    code = compile_doctest(source, "doc.rst", 4, 0)
+    with pytest.raises(KeyError) as e:
+        exec(code, new_namespace())
+    assert e.traceback[-1].lineno + 1 == 6
+
+
+def test_compile_doctest_syntax_error():
+    with pytest.raises(SyntaxError) as e:
+        compile_doctest(">>> x = 1\n>>> x = (\n", "doc.rst", 4, 0)
+    assert e.value.lineno == 6
+    assert e.value.text == "x = (\n"
+
+
+def test_rst_doctest(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=1)
+
+    result = pytester.runpytest("-v", "--rst-doctest")
+    result.stdout.fnmatch_lines(
+        [
+            "*test_doc.rst::doctest[[]4:8] PASSED*",
+            "*test_doc.rst::doctest[[]10:13] PASSED*",
+            "*test_doc.rst::doctest[[]15:20] PASSED*",
+            "*test_doc.rst::test_python[[]23:25] PASSED*",
+        ],
+    )
+    result.assert_outcomes(passed=4)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [(), ("--rst-mmap",), ("--rst-lazy-compile",), ("-p", "no:doctest")],
+)
+def test_rst_doctest_options(pytester, args):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest("--rst-doctest", *args)
+    result.assert_outcomes(passed=4)
+    # Second run loads the blocks from the collection cache
+    result = pytester.runpytest("--rst-doctest", *args)
+    result.assert_outcomes(passed=4)
+
+
+def test_rst_doctest_without_directives(pytester):
+    pytester.makefile(".rst", test_doc=">>> 1 + 1\n2\n")
+    result = pytester.runpytest("--rst-doctest")
+    result.assert_outcomes(passed=1)
+
+
+MISMATCH = dedent("""\
+    .. code-block:: pycon
+        :name: test_session
+
+        >>> x = 1
+        >>> x
+        2
+
+    >>> x
+    1
+
+    End.
+""")
+
+
+def test_rst_doctest_mismatch(pytester):
+    pytester.makefile(".rst", test_doc=MISMATCH)
+    result = pytester.runpytest("--rst-doctest")
+    result.stdout.fnmatch_lines(
+        [
+            "test_doc.rst:5: output mismatch",
+            "Expected:",
+            "    2",
+            "Got:",
+            "    1",
+        ],
+    )
+    # The following block shares the namespace and is skipped
+    result.assert_outcomes(failed=1, skipped=1)
+
+
+def test_rst_doctest_optionflags(pytester):
+    pytester.makefile(".rst", test_doc='>>> print("a    b")\na b\n')
+    result = pytester.runpytest("--rst-doctest")
+    result.assert_outcomes(failed=1)
+
+    pytester.makeini("[pytest]\ndoctest_optionflags = NORMALIZE_WHITESPACE\n")
+    result = pytester.runpytest("--rst-doctest")
+    result.assert_outcomes(passed=1)
+
+
+def test_without_pytest_doctest(pytester, monkeypatch):
+    config = pytester.parseconfig("--rst-doctest")
+    monkeypatch.setitem(sys.modules, "_pytest.doctest", None)
+    assert doctest_optionflags(config) == 0
+    checker = output_checker.__wrapped__()
+    assert type(checker) is doctest.OutputChecker
+    assert isinstance(doctest_parser.__wrapped__(), doctest.DocTestParser)
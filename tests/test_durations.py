@@ -0,0 +1,90 @@
+import time
+import tracemalloc
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import measure_usage
+
+
+DOCUMENT = dedent("""\
+    .. code-block:: python
+        :name: test_fast
+
+        assert True
+
+    .. code-block:: python
+        :name: test_slow
+        :fixtures: tmp_path
+
+        import time
+        time.sleep(0.05)
+
+    End.
+""")
+
+
+def test_measure_usage():
+    with measure_usage(trace_memory=False) as usage:
+        time.sleep(0.01)
+    assert usage.wall_time >= 0.01
+    assert usage.cpu_time >= 0
+    assert usage.peak_memory is None
+
+
+@pytest.mark.parametrize("tracing", [False, True])
+def test_measure_usage_memory(tracing):
+    if tracing:
+        tracemalloc.start()
+    try:
+        with measure_usage(trace_memory=True) as usage:
+            data = bytearray(1024 * 1024)
+        del data
+        assert usage.peak_memory is not None
+        assert usage.peak_memory >= 1024 * 1024
+        assert tracemalloc.is_tracing() is tracing
+    finally:
+        tracemalloc.stop()
+
+
+def test_user_properties_in_junitxml(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest("--junitxml=report.xml", "--rst-trace-memory")
+    result.assert_outcomes(passed=2)
+
+    report = (pytester.path / "report.xml").read_text()
+    assert report.count('name="rst_wall_time"') == 2
+    assert report.count('name="rst_cpu_time"') == 2
+    assert report.count('name="rst_peak_memory"') == 2
+
+
+def test_durations_report(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest("--rst-durations", "1")
+    result.stdout.fnmatch_lines(
+        [
+            "*= slowest 1 rst blocks =*",
+            "test_doc.rst",
+            "    9-12 test_slow: wall *s cpu *s",
+        ],
+    )
+    assert "test_fast" not in result.stdout.str()
+
+
+def test_durations_report_all(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest("--rst-durations", "0", "--rst-trace-memory")
+    result.stdout.fnmatch_lines(
+        [
+            "*= slowest rst blocks =*",
+            "test_doc.rst",
+            "    9-12 test_slow: wall *s cpu *s peak *B",
+            "    3-5 test_fast: wall *s cpu *s peak *B",
+        ],
+    )
+
+
+def test_no_durations_report_by_default(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest()
+    assert "slowest" not in result.stdout.str()
@@ -0,0 +1,163 @@
+import subprocess
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import GitChanges
+
+
+DOCUMENT = dedent("""\
+    .. code-block:: python
+        :name: test_first
+
+        assert True
+
+    Some text between the blocks.
+
+    .. code-block:: python
+        :name: test_second
+
+        assert True
+
+    End.
+""")
+
+
+def git(path, *args):
+    subprocess.run(
+        [
+            "git",
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@example.com",
+            *args,
+        ],
+        cwd=path,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture()
+def repo(pytester):
+    git(pytester.path, "init", "-q")
+    pytester.makefile(".rst", test_changed=DOCUMENT, test_unchanged=DOCUMENT)
+    git(pytester.path, "add", ".")
+    git(pytester.path, "commit", "-q", "-m", "initial")
+    return pytester
+
+
+def test_changed_files(repo):
+    path = repo.path / "test_changed.rst"
+    path.write_text(DOCUMENT.replace("End.", "The end."))
+    repo.makefile(".rst", test_new=DOCUMENT)
+
+    changes = GitChanges(repo.path, "HEAD")
+    assert changes.is_changed(path)
+    assert changes.is_changed(repo.path / "test_new.rst")
+    assert not changes.is_changed(repo.path / "test_unchanged.rst")
+
+    assert changes.intersects(path, 13, 13)
+    assert not changes.intersects(path, 1, 12)
+    assert changes.intersects(repo.path / "test_new.rst", 1, 1)
+
+
+def test_parse_diff_deletion(repo):
+    changes = GitChanges(repo.path, "HEAD")
+    changes.parse_diff(
+        dedent("""\
+            --- a/doc.rst
+            +++ b/doc.rst
+            @@ -3,2 +2,0 @@
+            -removed
+            -removed
+            @@ -10 +9,3 @@
+        """),
+    )
+    path = repo.path / "doc.rst"
+    assert changes.files[path] == [(2, 2), (9, 11)]
+
+
+def test_changed_since_selects_files(repo):
+    path = repo.path / "test_changed.rst"
+    path.write_text(DOCUMENT.replace("End.", "The end."))
+
+    result = repo.runpytest("-v", "--rst-changed-since", "HEAD")
+    result.stdout.fnmatch_lines(
+        ["rst: skipped 1 files unchanged since HEAD"],
+    )
+    result.assert_outcomes(passed=2)
+    assert "test_unchanged.rst" not in result.stdout.str()
+
+
+def test_changed_lines_selects_blocks(repo):
+    path = repo.path / "test_changed.rst"
+    path.write_text(DOCUMENT.replace("assert True", "assert 1", 1))
+
+    result = repo.runpytest(
+        "-v",
+        "--rst-changed-since",
+        "HEAD",
+        "--rst-changed-lines",
+    )
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.fnmatch_lines(["*test_first*PASSED*"])
+
+
+@pytest.mark.parametrize(
+    "old,new,selected",
+    [
+        (
+            "    :name: test_second\n",
+            "    :name: test_second\n    :fixtures: tmp_path\n",
+            "test_second",
+        ),
+        (".. code-block:: python\n", ".. code-block::  python\n", "test_first"),
+    ],
+    ids=["option", "directive"],
+)
+def test_changed_lines_covers_directive(repo, old, new, selected):
+    path = repo.path / "test_changed.rst"
+    path.write_text(DOCUMENT.replace(old, new, 1))
+
+    result = repo.runpytest(
+        "-v",
+        "--rst-changed-since",
+        "HEAD",
+        "--rst-changed-lines",
+    )
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.fnmatch_lines([f"*{selected}*PASSED*"])
+
+
+def test_changed_lines_keeps_shared_namespace(repo):
+    path = repo.path / "test_changed.rst"
+    path.write_text(
+        DOCUMENT.replace(
+            "    :name: test_first\n",
+            "    :name: test_first\n    :session: doc\n",
+        ).replace(
+            "    :name: test_second\n",
+            "    :name: test_second\n    :session: doc\n",
+        ),
+    )
+    git(repo.path, "commit", "-q", "-am", "session")
+    # Change only the second block
+    text = path.read_text()
+    index = text.rindex("assert True")
+    path.write_text(text[:index] + "assert 1" + text[index + 11:])
+
+    result = repo.runpytest(
+        "-v",
+        "--rst-changed-since",
+        "HEAD",
+        "--rst-changed-lines",
+    )
+    result.assert_outcomes(passed=2)
+
+
+def test_changed_since_bad_ref(repo):
+    result = repo.runpytest("--rst-changed-since", "no-such-ref")
+    result.stderr.fnmatch_lines(["*git diff failed*"])
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
@@ -0,0 +1,133 @@
+import json
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import extract_imports, modules_intersect, path_to_modules
+
+
+def test_extract_imports():
+    code = compile(
+        dedent("""\
+            import os
+            import os.path as osp
+            from collections import OrderedDict
+
+            def func():
+                import json
+
+            class Foo:
+                from email import message
+        """),
+        "doc.rst",
+        "exec",
+    )
+    assert extract_imports(code) == (
+        "collections",
+        "email",
+        "json",
+        "os",
+        "os.path",
+    )
+
+
+def test_extract_imports_nothing():
+    assert extract_imports(compile("x = 1", "doc.rst", "exec")) == ()
+
+
+def test_path_to_modules():
+    roots = [Path("/repo"), Path("/repo/src")]
+    assert path_to_modules(Path("/repo/src/pkg/mod.py"), roots) == {
+        "src.pkg.mod",
+        "pkg.mod",
+    }
+    assert path_to_modules(Path("/repo/src/pkg/__init__.py"), roots) == {
+        "src.pkg",
+        "pkg",
+    }
+    assert path_to_modules(Path("/repo/docs/index.rst"), roots) == set()
+    assert path_to_modules(Path("/other/mod.py"), roots) == set()
+    assert path_to_modules(Path("/repo/my-scripts/mod.py"), roots) == set()
+
+
+@pytest.mark.parametrize(
+    "imported,changed,expected",
+    [
+        ("pkg", "pkg", True),
+        ("pkg.mod", "pkg", True),
+        ("pkg", "pkg.mod", True),
+        ("pkg.mod", "pkg.other", False),
+        ("pkgs", "pkg", False),
+    ],
+)
+def test_modules_intersect(imported, changed, expected):
+    assert modules_intersect(imported, changed) is expected
+
+
+DOCUMENT = dedent("""\
+    .. code-block:: python
+        :name: test_uses_first
+
+        import first
+        assert first.VALUE == 1
+
+    .. code-block:: python
+        :name: test_uses_second
+
+        from second import VALUE
+        assert VALUE == 2
+
+    .. code-block:: python
+        :name: test_uses_nothing
+
+        assert True
+
+    End.
+""")
+
+
+@pytest.fixture()
+def project(pytester):
+    pytester.makepyfile(first="VALUE = 1", second="VALUE = 2")
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    pytester.syspathinsert()
+    return pytester
+
+
+def test_affected_by(project):
+    result = project.runpytest("-v", "--rst-affected-by", "first.py")
+    result.assert_outcomes(passed=1, deselected=2)
+    result.stdout.fnmatch_lines(["*test_uses_first*PASSED*"])
+
+
+def test_affected_by_multiple(project):
+    result = project.runpytest(
+        "-v",
+        "--rst-affected-by",
+        "first.py,second.py",
+    )
+    result.assert_outcomes(passed=2, deselected=1)
+
+
+def test_affected_by_rst_file(project):
+    result = project.runpytest("-v", "--rst-affected-by", "test_doc.rst")
+    result.assert_outcomes(passed=3)
+
+
+def test_imports_index_persisted(project):
+    project.runpytest()
+    index = json.loads(
+        (
+            project.path
+            / ".pytest_cache"
+            / "v"
+            / "pytest-rst"
+            / "imports"
+        ).read_text(),
+    )
+    assert index == {
+        "test_doc.rst::test_uses_first[3:6]": ["first"],
+        "test_doc.rst::test_uses_second[9:12]": ["second"],
+        "test_doc.rst::test_uses_nothing[15:17]": [],
+    }
@@ -0,0 +1,134 @@
+from textwrap import dedent
+
+from pytest_rst import SourceFile, find_includes
+
+
+SNIPPET = dedent("""\
+    Shared snippet
+
+    .. code-block:: python
+        :name: test_snippet
+
+        x = 1
+        assert x == 1
+
+    End.
+""")
+
+FAILING_SNIPPET = SNIPPET.replace("x == 1", "x == 2")
+
+
+def _page(name: str, *includes: str) -> str:
+    directives = "".join(f".. include:: {path}\n\n" for path in includes)
+    return dedent(f"""\
+        Page {name}
+
+        .. code-block:: python
+            :name: test_{name}
+
+            assert True
+
+        """) + directives + "End.\n"
+
+
+def test_find_includes(tmp_path):
+    path = tmp_path / "doc.rst"
+    path.write_text(
+        dedent("""\
+            .. include:: snippets/a.inc
+
+              .. include::   ../b.txt
+            .. include:: <isonum.txt>
+            .. include:: code.py
+               :code: python
+            .. include:: literal.txt
+               :literal:
+            .. include:: c.inc
+               :start-after: marker
+            Not an ..  include:: d.inc
+        """),
+    )
+    assert find_includes(SourceFile.read(path)) == [
+        tmp_path / "snippets" / "a.inc",
+        (tmp_path / ".." / "b.txt").resolve(),
+        tmp_path / "c.inc",
+    ]
+
+
+def test_find_includes_mapped(tmp_path):
+    path = tmp_path / "doc.rst"
+    path.write_text(".. include:: a.inc\r\n")
+    assert find_includes(SourceFile.read(path, mapped=True)) == [
+        tmp_path / "a.inc",
+    ]
+
+
+def test_include_collected_once(pytester):
+    pytester.makefile(".rst", page_a=_page("a", "snippets/shared.inc"))
+    pytester.makefile(".rst", page_b=_page("b", "snippets/shared.inc"))
+    pytester.mkdir("snippets")
+    pytester.path.joinpath("snippets", "shared.inc").write_text(SNIPPET)
+
+    result = pytester.runpytest("-v", "--rst-follow-includes")
+    result.stdout.fnmatch_lines(
+        [
+            "page_a.rst::test_a[[]5:7] PASSED*",
+            "snippets/shared.inc::test_snippet[[]5:8] PASSED*",
+            "page_b.rst::test_b[[]5:7] PASSED*",
+        ],
+    )
+    result.assert_outcomes(passed=3)
+
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=2)
+
+
+def test_include_failure_location(pytester):
+    pytester.makefile(".rst", page=_page("page", "shared.inc"))
+    pytester.path.joinpath("shared.inc").write_text(FAILING_SNIPPET)
+
+    result = pytester.runpytest("--rst-follow-includes")
+    result.stdout.fnmatch_lines(["shared.inc:7: AssertionError"])
+    result.assert_outcomes(passed=1, failed=1)
+
+
+def test_include_rst_collected_once(pytester):
+    # The included file is collected as included by page_a, and when
+    # collected on its own, in either order
+    pytester.makefile(".rst", page_a=_page("a", "page_c.rst"))
+    pytester.makefile(".rst", page_b=_page("b"))
+    pytester.makefile(".rst", page_c=_page("c", "page_b.rst"))
+
+    result = pytester.runpytest("--rst-follow-includes")
+    result.assert_outcomes(passed=3)
+
+
+def test_include_nested_cycle(pytester):
+    pytester.makefile(".rst", page=_page("page", "one.inc"))
+    pytester.path.joinpath("one.inc").write_text(_page("one", "two.inc"))
+    pytester.path.joinpath("two.inc").write_text(_page("two", "one.inc"))
+
+    result = pytester.runpytest("-v", "--rst-follow-includes")
+    result.stdout.fnmatch_lines(
+        [
+            "page.rst::test_page* PASSED*",
+            "one.inc::test_one* PASSED*",
+            "two.inc::test_two* PASSED*",
+        ],
+    )
+    result.assert_outcomes(passed=3)
+
+
+def test_include_only_page(pytester):
+    pytester.makefile(".rst", page=".. include:: shared.inc\n")
+    pytester.path.joinpath("shared.inc").write_text(SNIPPET)
+
+    result = pytester.runpytest("--rst-follow-includes")
+    result.assert_outcomes(passed=1)
+
+
+def test_include_missing(pytester):
+    pytester.makefile(".rst", page=_page("page", "missing.inc"))
+
+    result = pytester.runpytest("--rst-follow-includes")
+    result.assert_outcomes(passed=1)
@@ -0,0 +1,180 @@
+import multiprocessing
+import sys
+
+import pytest
+
+from .conftest import rst_block, rst_document
+
+
+def test_isolated_blocks(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_marker", "import sys\nsys.rst_marker = 1"),
+            rst_block(
+                "test_fixture",
+                "# fixtures: tmp_path\nassert tmp_path.is_dir()",
+            ),
+        ),
+    )
+    pytester.makepyfile(
+        test_process="""
+            import sys
+
+            def test_not_leaked():
+                assert not hasattr(sys, "rst_marker")
+        """,
+    )
+    result = pytester.runpytest("-v", "--rst-isolate", "-p", "no:randomly")
+    result.assert_outcomes(passed=3)
+
+
+def test_isolated_failure_traceback(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block(
+                "test_fails",
+                "x = 1\n\ndef check():\n    assert x == 2\n\ncheck()",
+            ),
+        ),
+    )
+    result = pytester.runpytest("--rst-isolate")
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            '*File "*test_doc.rst", line 9, in <module>',
+            '*File "*test_doc.rst", line 7, in check',
+            "AssertionError*",
+        ],
+    )
+
+
+def test_isolated_skip_and_xfail(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_skip", "import pytest\npytest.skip('not here')"),
+            rst_block("test_xfail", "import pytest\npytest.xfail('known bug')"),
+            rst_block("test_fail", "import pytest\npytest.fail('broken')"),
+        ),
+    )
+    result = pytester.runpytest("-rsx", "--rst-isolate")
+    result.assert_outcomes(skipped=1, xfailed=1, failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "SKIPPED [[]1[]] test_doc.rst:1: not here",
+            "XFAIL test_doc.rst::test_xfail* - known bug",
+        ],
+    )
+    result.stdout.fnmatch_lines(["*Failed: broken"])
+
+
+def test_isolated_worker_reused(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_first", "import sys\nsys.rst_marker = 1"),
+            rst_block("test_second", "import sys\nassert sys.rst_marker == 1"),
+        ),
+    )
+    result = pytester.runpytest("--rst-isolate")
+    result.assert_outcomes(passed=2)
+
+    result = pytester.runpytest("--rst-isolate", "--rst-isolate-max-blocks=1")
+    result.assert_outcomes(passed=1, failed=1)
+
+
+def test_isolated_timeout(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_slow", "import time\ntime.sleep(30)"),
+            rst_block("test_fast", "assert True"),
+        ),
+    )
+    result = pytester.runpytest(
+        "--rst-isolate",
+        "--rst-isolate-timeout=0.5",
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["Timeout after 0.5s"])
+
+
+def test_isolated_crash(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_crash", "import os\nos._exit(3)"),
+            rst_block("test_after", "assert True"),
+        ),
+    )
+    result = pytester.runpytest("--rst-isolate")
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["Worker process exited with code 3*"])
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"),
+    reason="RSS is read from /proc",
+)
+def test_isolated_max_rss(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_hungry", "data = bytearray(256 * 1024 * 1024)"),
+            rst_block("test_after", "assert True"),
+        ),
+    )
+    result = pytester.runpytest(
+        "--rst-isolate",
+        "--rst-isolate-max-rss=128",
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(["Worker RSS * exceeds the limit of *"])
+
+
+def test_isolated_preload(pytester):
+    pytester.makepyfile(warm_module="WARM = True")
+    pytester.makeini("[pytest]\nrst_preload = warm_module, json\n")
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block(
+                "test_warm",
+                "import sys\nassert 'warm_module' in sys.modules",
+            ),
+        ),
+    )
+    pytester.syspathinsert()
+    result = pytester.runpytest("--rst-isolate")
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.skipif(
+    "forkserver" not in multiprocessing.get_all_start_methods(),
+    reason="forkserver is not available",
+)
+def test_isolated_forkserver(pytester):
+    pytester.makepyfile(warm_module="WARM = True")
+    pytester.makeini("[pytest]\nrst_preload = warm_module\n")
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block(
+                "test_first",
+                "import sys\nassert 'warm_module' in sys.modules\n"
+                "sys.rst_marker = 1",
+            ),
+            rst_block(
+                "test_second",
+                "import sys\nassert not hasattr(sys, 'rst_marker')",
+            ),
+        ),
+    )
+    # The fork server is started once per interpreter
+    result = pytester.runpytest_subprocess(
+        "--rst-isolate",
+        "--rst-isolate-backend=forkserver",
+    )
+    result.assert_outcomes(passed=2)
@@ -0,0 +1,128 @@
+import sys
+from textwrap import dedent
+
+import pytest_rst
+
+
+DOC = dedent("""\
+    .. code-block:: python
+        :name: test_first
+
+        assert True
+
+    .. code-block:: python
+        :name: test_fixture
+        :fixtures: tmp_path
+
+        assert tmp_path.is_dir()
+        assert False
+
+    .. code-block:: python
+        :name: test_broken
+
+        def broken(
+
+    End.
+""")
+
+
+def _cache_entries(pytester) -> list:
+    directory = pytester.path / ".pytest_cache" / "d" / "pytest-rst"
+    return sorted(directory.iterdir()) if directory.exists() else []
+
+
+def test_lazy_compile_errors_in_setup(pytester):
+    pytester.makefile(".rst", test_doc=DOC)
+
+    result = pytester.runpytest()
+    result.assert_outcomes(errors=1)
+
+    result = pytester.runpytest("-v", "--rst-lazy-compile")
+    result.assert_outcomes(passed=1, failed=1, errors=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_first*PASSED*",
+            "*test_fixture*FAILED*",
+            "*test_broken*ERROR*",
+        ],
+    )
+    result.stdout.fnmatch_lines(["test_doc.rst:11: AssertionError"])
+    # Not stored until every block compiled
+    assert _cache_entries(pytester) == []
+
+
+def test_lazy_compile_only_selected(pytester, monkeypatch):
+    pytester.makefile(".rst", test_doc=DOC)
+    compiled = []
+    original = pytest_rst.compile_source
+
+    def compile_source(source, filename, offset):
+        compiled.append(offset)
+        return original(source, filename, offset)
+
+    monkeypatch.setattr(pytest_rst, "compile_source", compile_source)
+
+    reprec = pytester.inline_run("--rst-lazy-compile", "-k", "test_first")
+    reprec.assertoutcome(passed=1)
+    assert compiled == [3]
+
+
+def test_lazy_compile_stores_cache(pytester):
+    valid = DOC[:DOC.index(".. code-block:: python\n    :name: test_broken")]
+    pytester.makefile(".rst", test_doc=valid + "End.\n")
+
+    result = pytester.runpytest("--rst-lazy-compile")
+    result.assert_outcomes(passed=1, failed=1)
+    assert len(_cache_entries(pytester)) == 1
+
+    result = pytester.runpytest("--rst-lazy-compile")
+    result.assert_outcomes(passed=1, failed=1)
+
+
+def test_pushdown_node_id(pytester):
+    pytester.makefile(".rst", test_doc=DOC)
+
+    result = pytester.runpytest(
+        "--collect-only",
+        "--rst-lazy-compile",
+        "--rst-select-pushdown",
+        "test_doc.rst::test_first",
+    )
+    result.stdout.fnmatch_lines(["*1 test collected*"])
+
+    result = pytester.runpytest(
+        "--rst-lazy-compile",
+        "--rst-select-pushdown",
+        "test_doc.rst::test_fixture[9:12]",
+    )
+    result.assert_outcomes(failed=1)
+
+
+def test_pushdown_keyword(pytester):
+    pytester.makefile(".rst", test_doc=DOC)
+
+    result = pytester.runpytest(
+        "--rst-lazy-compile",
+        "--rst-select-pushdown",
+        "-k",
+        "first or fixture",
+    )
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.no_fnmatch_line("*deselected*")
+
+    result = pytester.runpytest("--rst-lazy-compile", "-k", "first")
+    result.stdout.fnmatch_lines(["*1 passed, 2 deselected*"])
+
+
+def test_pushdown_keyword_without_private_api(pytester, monkeypatch):
+    # Blocks are deselected by pytest when its private API is gone
+    monkeypatch.setitem(sys.modules, "_pytest.mark.expression", None)
+    pytester.makefile(".rst", test_doc=DOC)
+
+    result = pytester.runpytest_inprocess(
+        "--rst-lazy-compile",
+        "--rst-select-pushdown",
+        "-k",
+        "first",
+    )
+    result.stdout.fnmatch_lines(["*1 passed, 2 deselected*"])
@@ -0,0 +1,124 @@
+import mmap
+import os
+import subprocess
+import sys
+from io import StringIO
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import SourceFile, parse_code_blocks, parse_code_blocks_mapped
+
+
+DOCUMENTS = [
+    (Path(__file__).parent / "sample.rst").read_text(),
+    dedent("""\
+        Text mentioning .. code-block:: python in the middle of a line.
+
+        .. code-block:: python
+            :name: test_first
+            :fixtures: tmp_path
+
+            x = 1
+
+            # blank lines inside
+            assert x
+        .. code-block:: python
+            :name: test_closing_line_opens
+
+            assert True
+
+        .. note::
+
+            .. code-block:: python
+                :name: test_nested
+
+                def f():
+                    return 1
+
+                assert f() == 1
+
+            Closing text.
+
+        .. code-block:: bash
+
+            echo not python
+
+        .. code-block::
+
+            no syntax
+
+        .. code-block:: python
+            :name: test_tabs
+
+        \tassert True
+          \t
+        Done.
+    """),
+    ".. code-block:: python\n    :name: test_eof\n\n    assert True\n",
+    ".. code-block:: python\n    :name: test_no_newline\n\n    x\nEnd",
+    ".. code-block:: python\n\n    s = 'é　'\n    　\n\nEnd.\n",
+    "",
+]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_mapped_parser_matches_streaming(document, tmp_path):
+    expected = list(parse_code_blocks(StringIO(document)))
+    assert list(parse_code_blocks_mapped(document.encode())) == expected
+
+    path = tmp_path / "doc.rst"
+    path.write_bytes(document.encode())
+    with SourceFile.read(path, mapped=True) as source:
+        if document:
+            assert isinstance(source.data, mmap.mmap)
+            assert list(parse_code_blocks_mapped(source.data)) == expected
+        assert source.digest == SourceFile.read(path).digest
+    if isinstance(source.data, mmap.mmap):
+        assert source.data.closed
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+def test_source_decoded_as_utf8(tmp_path, mapped):
+    path = tmp_path / "doc.rst"
+    path.write_text(DOCUMENTS[2] + 'End "\u00e9".\n', encoding="utf-8")
+    script = (
+        "import sys; from pathlib import Path; import pytest_rst; "
+        "source = pytest_rst.SourceFile.read(Path(sys.argv[1]), "
+        "mapped=sys.argv[2] == 'True'); "
+        "assert len(source.compile('test_')) == 1"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script, str(path), str(mapped)],
+        env={
+            **os.environ,
+            "LC_ALL": "C",
+            "PYTHONCOERCECLOCALE": "0",
+            "PYTHONUTF8": "0",
+        },
+        check=True,
+    )
+
+
+def test_mapped_parser_crlf():
+    document = DOCUMENTS[1]
+    expected = list(parse_code_blocks(StringIO(document)))
+    crlf = document.replace("\n", "\r\n").encode()
+    assert list(parse_code_blocks_mapped(crlf)) == expected
+
+
+def test_mapped_parser_decodes_only_blocks():
+    document = b"\xff invalid prose\n\n" + DOCUMENTS[2].encode() + b"End.\n"
+    blocks = list(parse_code_blocks_mapped(document))
+    assert [block.lines for block in blocks] == [("assert True",)]
+
+
+def test_mmap_option(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENTS[1], test_empty="")
+    expected = pytester.runpytest("-v", "-p", "no:cacheprovider")
+    expected.assert_outcomes(passed=4)
+
+    result = pytester.runpytest("-v", "-p", "no:cacheprovider", "--rst-mmap")
+    assert result.parseoutcomes() == expected.parseoutcomes()
+    result.stdout.fnmatch_lines(["*test_nested*PASSED*"])
@@ -0,0 +1,101 @@
+import os
+from textwrap import dedent
+
+from pytest_rst import ParallelCompiler, SourceFile, discover_rst_files
+
+
+def _document(index: int) -> str:
+    return dedent(f"""\
+        Example {index}:
+
+        .. code-block:: python
+            :name: test_block_{index}
+
+            assert {index} == {index}
+
+        End.
+    """)
+
+
+def test_parallel_compiler_result(tmp_path):
+    path = tmp_path / "doc.rst"
+    path.write_text(_document(1))
+
+    compiler = ParallelCompiler(1, "test_")
+    try:
+        source = SourceFile.read(path)
+        compiler.submit(source)
+        assert compiler.source(path) is source
+        assert compiler.result(source) == source.compile("test_")
+        # Result is handed over only once
+        assert compiler.result(source) is None
+    finally:
+        compiler.shutdown()
+
+
+def test_parallel_compiler_changed_file(tmp_path):
+    path = tmp_path / "doc.rst"
+    path.write_text(_document(1))
+
+    compiler = ParallelCompiler(1, "test_")
+    try:
+        compiler.submit(SourceFile.read(path))
+        compiler.futures[path.resolve()][1].result()
+        path.write_text(_document(2))
+        os.utime(path, ns=(0, 0))
+        assert compiler.source(path) is None
+        assert compiler.result(SourceFile.read(path)) is None
+    finally:
+        compiler.shutdown()
+
+
+def test_discover_rst_files(pytester):
+    pytester.makefile(".rst", top="")
+    pytester.mkdir("docs")
+    pytester.mkdir("build")
+    pytester.mkdir("ignored")
+    (pytester.path / "docs" / "page.rst").write_text("")
+    (pytester.path / "docs" / "page.txt").write_text("")
+    (pytester.path / "build" / "page.rst").write_text("")
+    (pytester.path / "ignored" / "page.rst").write_text("")
+
+    config = pytester.parseconfigure(
+        "-o",
+        "norecursedirs=build",
+        "--ignore=ignored",
+    )
+    config.args = [str(pytester.path)]
+    found = [
+        p.relative_to(pytester.path).as_posix()
+        for p in discover_rst_files(config)
+    ]
+    assert found == ["top.rst", "docs/page.rst"]
+
+
+def test_parallel_collection(pytester):
+    for index in range(5):
+        pytester.makefile(".rst", **{f"test_doc_{index}": _document(index)})
+
+    result = pytester.runpytest("-v", "--rst-collect-workers", "2")
+    result.assert_outcomes(passed=5)
+
+    # Second run is served from the collection cache
+    result = pytester.runpytest("-v", "--rst-collect-workers", "2")
+    result.assert_outcomes(passed=5)
+
+
+def test_parallel_collection_syntax_error(pytester):
+    pytester.makefile(
+        ".rst",
+        test_broken=dedent("""\
+            .. code-block:: python
+                :name: test_broken
+
+                def foo(
+
+            End.
+        """),
+    )
+    result = pytester.runpytest("--rst-collect-workers", "1")
+    result.stdout.fnmatch_lines(["*SyntaxError*"])
+    assert result.ret != 0
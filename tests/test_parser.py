@@ -25,6 +25,12 @@ INDENT_CASES = [
     [" ", -1],
     ["  ", -1],
     [" \n", -1],
+    ["", -1],
+    ["\t\n", -1],
+    ["  \t \x0c\n", -1],
+    ["  \tfoo", 2],
+    ["\u00a0foo", 0],
+    ["    \u3000", -1],
 ]
 
 
@@ -101,6 +107,11 @@ def test_parser(sample_fp):
     ]
 
 
+def test_parser_directive_lines(sample_fp):
+    blocks = list(parse_code_blocks(sample_fp))
+    assert [b.directive_line for b in blocks] == [2, 9, 15, 30, 37, 46]
+
+
 PARSE_FIXTURES_CASES = [
     ("", ()),
     ("tmp_path", ("tmp_path",)),
@@ -306,6 +317,15 @@ def test_make_rst_test_func_sets_dunder_name():
     assert collected == ["__main__"]
 
 
+@pytest.mark.parametrize("name", ["code", "namespace", "ns", "run"])
+def test_make_rst_test_func_fixture_named_like_helpers(name):
+    code = compile(f"result.append({name})", "<test>", "exec")
+    fn = _make_rst_test_func(code, (name, "result"))
+    collected: list[str] = []
+    fn(**{name: "value", "result": collected})
+    assert collected == ["value"]
+
+
 # --- Additional integration tests ---
 
 
@@ -1583,3 +1603,56 @@ class TestCommentFixturesIntegration:
         result = pytester.runpytest("-v")
         result.stdout.fnmatch_lines(["*test_comment_custom*PASSED*"])
         assert result.ret == 0
+
+
+class _CountingReader:
+    def __init__(self, text):
+        self.lines = text.splitlines(keepends=True)
+        self.consumed = 0
+
+    def seek(self, offset):
+        assert offset == 0
+        self.consumed = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.consumed += 1
+            yield line
+
+
+def test_parser_is_streaming():
+    text = dedent("""\
+        .. code-block:: python
+            :name: test_first
+
+            assert True
+
+        Text
+    """) + "filler\n" * 1000
+    fp = _CountingReader(text)
+
+    blocks = parse_code_blocks(fp)  # type: ignore[arg-type]
+    block = next(blocks)
+    assert block.lines == ("assert True",)
+    assert fp.consumed == 6
+
+    assert list(blocks) == []
+    assert fp.consumed == len(fp.lines)
+
+
+def test_make_rst_test_func_reuses_wrapper_code():
+    first = compile("result.append(1)", "<test>", "exec")
+    second = compile("result.append(2)", "<test>", "exec")
+    fn_first = _make_rst_test_func(first, ("result",))
+    fn_second = _make_rst_test_func(second, ("result",))
+
+    assert fn_first is not fn_second
+    assert fn_first.__code__ is fn_second.__code__
+    assert _make_rst_test_func(first, ("other",)).__code__ is not (
+        fn_first.__code__
+    )
+
+    collected: list[int] = []
+    fn_first(result=collected)
+    fn_second(result=collected)
+    assert collected == [1, 2]
@@ -0,0 +1,66 @@
+from textwrap import dedent
+
+import pytest
+
+from pytest_rst import has_candidate_blocks
+
+
+@pytest.mark.parametrize(
+    "content,prefix,expected",
+    [
+        ("", "test_", False),
+        ("Just text\n", "test_", False),
+        (".. code-block:: python\n\n    pass\n", "test_", False),
+        (":name: test_x\n", "test_", False),
+        (".. code-block:: python\n    :name: test_x\n", "test_", True),
+        (".. code-block:: python\n    :name: doc_x\n", "doc_", True),
+        (".. code-block:: python\n    :name: doc_x\n", "test_", False),
+    ],
+)
+def test_has_candidate_blocks(tmp_path, content, prefix, expected):
+    path = tmp_path / "doc.rst"
+    path.write_text(content)
+    assert has_candidate_blocks(path, prefix) is expected
+
+
+def test_skipped_files_reported(pytester):
+    pytester.makefile(".rst", plain="Nothing to see here\n")
+    pytester.makefile(
+        ".rst",
+        unnamed=".. code-block:: python\n\n    assert False\n\nEnd.\n",
+    )
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_included
+
+                assert True
+
+            End.
+        """),
+    )
+    result = pytester.runpytest("-v")
+    result.stdout.fnmatch_lines(
+        [
+            "rst: skipped 2 of 3 files without candidate code blocks",
+            "*test_included*PASSED*",
+        ],
+    )
+    assert result.ret == 0
+
+
+def test_no_report_without_skipped_files(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_included
+
+                assert True
+
+            End.
+        """),
+    )
+    result = pytester.runpytest()
+    assert "rst: skipped" not in result.stdout.str()
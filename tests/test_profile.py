@@ -0,0 +1,72 @@
+import json
+import pstats
+from textwrap import dedent
+
+from pytest_rst import PhaseTimer
+
+
+DOCUMENT = dedent("""\
+    .. code-block:: python
+        :name: test_plain
+
+        assert True
+
+    .. code-block:: python
+        :name: test_fixture
+
+        # fixtures: tmp_path
+        assert tmp_path.is_dir()
+
+    End.
+""")
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    with timer.phase("first"):
+        pass
+    with timer.phase("first"):
+        pass
+    assert list(timer.iterate("second", range(3))) == [0, 1, 2]
+    assert set(timer.phases) == {"first", "second"}
+    assert all(value >= 0 for value in timer.phases.values())
+
+
+def test_profile_report(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest("--rst-profile-collect=profile.json")
+    result.assert_outcomes(passed=2)
+
+    report = json.loads((pytester.path / "profile.json").read_text())
+    assert report["collection_seconds"] > 0
+    assert set(report["files"]) == {"test_doc.rst"}
+    assert set(report["files"]["test_doc.rst"]) == {
+        "io",
+        "cache",
+        "parse",
+        "fixtures",
+        "compile",
+        "wrapper",
+    }
+    assert set(report["totals"]) == set(report["files"]["test_doc.rst"])
+
+
+def test_profile_report_cached(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    pytester.runpytest()
+    pytester.runpytest("--rst-profile-collect=profile.json")
+
+    report = json.loads((pytester.path / "profile.json").read_text())
+    assert set(report["files"]["test_doc.rst"]) == {"io", "cache", "wrapper"}
+
+
+def test_profile_cprofile_dump(pytester):
+    pytester.makefile(".rst", test_doc=DOCUMENT)
+    result = pytester.runpytest(
+        "--rst-profile-collect=profile.json",
+        "--rst-profile-collect-cprofile=collect.prof",
+    )
+    result.assert_outcomes(passed=2)
+    stats = pstats.Stats(str(pytester.path / "collect.prof"))
+    functions = {name for _, _, name in stats.stats}  # type: ignore
+    assert "compile_code_blocks" in functions
@@ -0,0 +1,89 @@
+import pytest
+
+from pytest_rst import Sharding
+
+from .conftest import rst_block, rst_document
+
+
+@pytest.mark.parametrize("value", ["0/2", "3/2", "1", "a/b", "1/0"])
+def test_shard_parse_invalid(value):
+    with pytest.raises(pytest.UsageError):
+        Sharding.parse(value)
+
+
+def test_shard_parse():
+    assert Sharding.parse("2/3") == (2, 3)
+
+
+def passed(reprec) -> set:
+    return {
+        report.nodeid
+        for report in reprec.getreports()
+        if report.when == "call" and report.passed
+    }
+
+
+def test_shards_cover_all_blocks(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            *(rst_block(f"test_block_{i}", "assert True") for i in range(7)),
+        ),
+    )
+    # Without the cache every CI node splits by line count
+    args = ("-p", "no:cacheprovider")
+    everything = passed(pytester.inline_run(*args))
+    assert len(everything) == 7
+
+    def run_shards() -> list:
+        return [
+            passed(pytester.inline_run(*args, f"--rst-shard={i}/3"))
+            for i in (1, 2, 3)
+        ]
+
+    shards = run_shards()
+    assert set.union(*shards) == everything
+    assert sum(len(shard) for shard in shards) == 7
+    assert all(shards)
+    assert shards == run_shards()
+
+
+def test_shards_balanced_by_durations(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_slow", "__import__('time').sleep(0.3)"),
+            *(rst_block(f"test_fast_{i}", "assert True") for i in range(3)),
+        ),
+    )
+    # Without durations all blocks weigh the same
+    assert len(passed(pytester.inline_run("--rst-shard=1/2"))) == 2
+
+    pytester.runpytest()
+    first = passed(pytester.inline_run("--rst-shard=1/2"))
+    assert [nodeid.split("::")[1] for nodeid in first] == ["test_slow[3:5]"]
+    assert len(passed(pytester.inline_run("--rst-shard=2/2"))) == 3
+
+    result = pytester.runpytest("--rst-shard=2/2")
+    result.stdout.fnmatch_lines(
+        [
+            "*rst shard 2/2*",
+            "3 blocks, predicted *s, actual *s",
+            "predicted shards: *s, *s",
+        ],
+    )
+
+
+def test_shards_keep_shared_namespace(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=rst_document(
+            rst_block("test_first", "x = 1", session="ns"),
+            rst_block("test_second", "assert x == 1", session="ns"),
+            rst_block("test_other", "assert True"),
+        ),
+    )
+    shards = [
+        passed(pytester.inline_run(f"--rst-shard={i}/2")) for i in (1, 2)
+    ]
+    assert sorted(len(shard) for shard in shards) == [1, 2]
@@ -0,0 +1,140 @@
+from textwrap import dedent
+
+
+SESSION_DOC = dedent("""\
+    Setup:
+
+    .. code-block:: python
+        :name: test_setup
+        :session: tutorial
+
+        import json
+        data = {"a": 1}
+
+    Use:
+
+    .. code-block:: python
+        :name: test_use
+        :session: tutorial
+
+        assert json.loads(json.dumps(data)) == {"a": 1}
+
+    Isolated:
+
+    .. code-block:: python
+        :name: test_isolated
+
+        assert "data" not in globals()
+
+    End.
+""")
+
+
+def test_session_option_shares_namespace(pytester):
+    pytester.makefile(".rst", test_doc=SESSION_DOC)
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=3)
+
+
+def test_sessions_are_separate(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_first
+                :session: one
+
+                value = 1
+
+            .. code-block:: python
+                :name: test_second
+                :session: two
+
+                assert "value" not in globals()
+
+            End.
+        """),
+    )
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=2)
+
+
+def test_shared_namespace_option(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_first
+
+                value = 1
+
+            .. code-block:: python
+                :name: test_second
+                :fixtures: tmp_path
+
+                assert value == 1
+                assert tmp_path.is_dir()
+
+            End.
+        """),
+    )
+    pytester.makefile(
+        ".rst",
+        test_other=dedent("""\
+            .. code-block:: python
+                :name: test_third
+
+                assert "value" not in globals()
+
+            End.
+        """),
+    )
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=2, failed=1)
+
+    result = pytester.runpytest("-v", "--rst-shared-namespace")
+    result.assert_outcomes(passed=3)
+
+
+def test_failure_skips_rest_of_session(pytester):
+    pytester.makefile(
+        ".rst",
+        test_doc=dedent("""\
+            .. code-block:: python
+                :name: test_broken
+                :session: tutorial
+
+                raise RuntimeError("setup failed")
+
+            .. code-block:: python
+                :name: test_dependent
+                :session: tutorial
+
+                assert True
+
+            .. code-block:: python
+                :name: test_independent
+
+                assert True
+
+            End.
+        """),
+    )
+    result = pytester.runpytest("-v", "-rs")
+    result.assert_outcomes(passed=1, failed=1, skipped=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*previous block test_broken[[]4:6[]] in shared namespace "
+            "'tutorial' failed*",
+        ],
+    )
+
+
+def test_session_blocks_keep_document_order(pytester):
+    pytester.makefile(".rst", test_doc=SESSION_DOC)
+    pytester.makeconftest("""
+        def pytest_collection_modifyitems(items):
+            items.reverse()
+    """)
+    result = pytester.runpytest("-v")
+    result.assert_outcomes(passed=3)
@@ -0,0 +1,160 @@
+from textwrap import dedent
+
+from pytest_rst import ITEM_POSITIONS_KEY, following_items
+
+from .conftest import rst_block, rst_document
+
+
+CONFTEST = """
+    import sys
+    import threading
+
+    def pytest_configure():
+        sys.rst_event = threading.Event()
+"""
+
+
+def make_document(**options: str) -> str:
+    return rst_document(
+        rst_block(
+            "test_waiter",
+            "import sys\n\nassert sys.rst_event.wait(1)",
+            **options,
+        ),
+        rst_block("test_failing", "raise ValueError('in thread')", **options),
+        rst_block(
+            "test_setter",
+            "import sys\n\nsys.rst_event.set()",
+            **options,
+        ),
+        rst_block(
+            "test_fixture",
+            "assert tmp_path.is_dir()",
+            fixtures="tmp_path",
+            **options,
+        ),
+    )
+
+
+def test_parallel_blocks(pytester):
+    pytester.makeconftest(CONFTEST)
+    pytester.makefile(".rst", test_doc=make_document(parallel=""))
+
+    result = pytester.runpytest("-v", "--rst-parallel-threads=4")
+    result.assert_outcomes(passed=3, failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_waiter*PASSED*",
+            "*test_failing*FAILED*",
+            "*test_setter*PASSED*",
+            "*test_fixture*PASSED*",
+        ],
+    )
+    result.stdout.fnmatch_lines(["E   ValueError: in thread"])
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2, failed=2)
+
+    # The setter is not in the batch of two blocks with the waiter
+    result = pytester.runpytest("--rst-parallel-threads=2")
+    result.assert_outcomes(passed=2, failed=2)
+
+
+def test_parallel_ini_glob(pytester):
+    pytester.makeconftest(CONFTEST)
+    pytester.makefile(".rst", test_doc=make_document())
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2, failed=2)
+
+    pytester.makeini("[pytest]\nrst_parallel = test_*.rst\n")
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=2, failed=2)
+    result = pytester.runpytest("--rst-parallel-threads=4")
+    result.assert_outcomes(passed=3, failed=1)
+
+
+def test_parallel_batch_per_file(pytester):
+    # The setter in another file does not run in the batch of the waiter
+    pytester.makeconftest(CONFTEST)
+    document = make_document(parallel="")
+    setter = document.index(".. code-block:: python\n    :name: test_setter")
+    pytester.makefile(".rst", test_a=document[:setter] + "End.\n")
+    pytester.makefile(".rst", test_b=document[setter:])
+
+    result = pytester.runpytest("--rst-parallel-threads=4")
+    result.assert_outcomes(passed=2, failed=2)
+
+
+OUTPUT_DOC = dedent("""\
+    .. code-block:: python
+        :name: test_first
+        :parallel:
+
+        import sys
+        import time
+
+        print("first output")
+        time.sleep(0.1)
+        print("first error", file=sys.stderr)
+        assert False
+
+    .. code-block:: python
+        :name: test_second
+        :parallel:
+
+        print("second output")
+        raise ValueError("second")
+
+    .. code-block:: python
+        :name: test_third
+        :parallel:
+
+        open("third.txt", "w").close()
+
+    End.
+""")
+
+
+def test_parallel_output(pytester):
+    pytester.makefile(".rst", test_doc=OUTPUT_DOC)
+
+    result = pytester.runpytest("--rst-parallel-threads=4")
+    result.assert_outcomes(passed=1, failed=2)
+    result.stdout.fnmatch_lines(
+        [
+            "*- Captured stdout call -*",
+            "first output",
+            "*- Captured stderr call -*",
+            "first error",
+            "*- Captured stdout call -*",
+            "second output",
+        ],
+    )
+    assert result.stdout.lines.count("first output") == 1
+    assert result.stdout.lines.count("second output") == 1
+
+
+def test_parallel_maxfail(pytester):
+    pytester.makefile(".rst", test_doc=OUTPUT_DOC)
+
+    result = pytester.runpytest("--rst-parallel-threads=4", "-x")
+    result.assert_outcomes(failed=1)
+    assert not pytester.path.joinpath("third.txt").exists()
+
+
+def test_following_items(pytester):
+    pytester.makefile(".rst", test_doc=make_document(parallel=""))
+    pytester.makefile(".rst", test_other=make_document(parallel=""))
+    items, _ = pytester.inline_genitems()
+    session = items[0].session
+    session.items = items
+    first, second, third, fourth, other, *_ = items
+
+    assert following_items(second, lambda i: True) == [second, third, fourth]
+    assert following_items(first, lambda i: i is not second, limit=2) == [
+        first,
+        third,
+    ]
+    assert following_items(fourth, lambda i: True) == [fourth]
+    assert session.stash[ITEM_POSITIONS_KEY][other] == 4
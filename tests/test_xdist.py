@@ -0,0 +1,66 @@
+import pytest
+
+from .conftest import rst_block, rst_document
+
+
+pytest.importorskip("xdist")
+
+
+def make_document(**options: str) -> str:
+    return rst_document(
+        rst_block("test_one", "assert True", **options),
+        rst_block("test_two", "assert True", **options),
+    )
+
+
+def test_xdist_workers_use_warm_cache(pytester):
+    pytester.makefile(".rst", test_a=make_document(), test_b=make_document())
+    pytester.makeconftest("""
+        import os
+        from pathlib import Path
+
+        def pytest_configure(config):
+            if not hasattr(config, "workerinput"):
+                return
+            directory = Path(".pytest_cache", "d", "pytest-rst")
+            worker = config.workerinput["workerid"]
+            Path(f"{worker}.txt").write_text(
+                str(len(list(directory.iterdir()))),
+            )
+    """)
+
+    result = pytester.runpytest("-n", "2", "--rst-cache-clear")
+    result.assert_outcomes(passed=4)
+    assert (pytester.path / "gw0.txt").read_text() == "2"
+    assert (pytester.path / "gw1.txt").read_text() == "2"
+
+
+def test_xdist_group_by_file(pytester):
+    pytester.makefile(".rst", test_a=make_document(), test_b=make_document())
+
+    result = pytester.runpytest(
+        "-n",
+        "2",
+        "-v",
+        "--dist",
+        "loadgroup",
+        "--rst-xdist-group",
+        "file",
+    )
+    result.assert_outcomes(passed=4)
+    result.stdout.fnmatch_lines(["*PASSED*test_a.rst::test_one*@test_a.rst*"])
+
+
+def test_xdist_group_shared_namespace(pytester):
+    pytester.makefile(
+        ".rst",
+        test_a=make_document(session="docs"),
+        test_b=make_document(),
+    )
+
+    result = pytester.runpytest("-n", "2", "-v", "--dist", "loadgroup")
+    result.assert_outcomes(passed=4)
+    result.stdout.fnmatch_lines(
+        ["*PASSED*test_a.rst::test_one*@test_a.rst::docs*"],
+    )
+    result.stdout.no_fnmatch_line("*test_b.rst::test_one*@*")